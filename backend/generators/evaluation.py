@@ -1,4 +1,6 @@
 import dspy
+from backend.utils.concurrency import limiter
+from backend.generators.extractor_agent import key_point_extractor, clean_json_field, score_key_point_coverage
 
 class AnswerEvaluationSignature(dspy.Signature):
     """
@@ -37,3 +39,58 @@ class AnswerEvaluator(dspy.Module):
             correct_answer=correct_answer
         )
         return result
+
+    async def aforward(self, user_answer, keypoints, correct_answer):
+        async with limiter("llm"):
+            return await self.evaluate.acall(
+                user_answer=user_answer,
+                keypoints=keypoints,
+                correct_answer=correct_answer
+            )
+
+
+GRADING_MODES = ("llm", "local")
+
+def local_evaluation(key_points, user_answer, correct_answer):
+    """
+    Deterministic grading from exact key-point matches. Only a clear pass
+    (every score-1 threshold met) or a blank answer is decided locally;
+    anything else may be a paraphrase and returns None so the LLM decides.
+    """
+    if not user_answer.strip():
+        coverage = {"score": 0, "coverage_percent": 0, "missed_points": list(key_points)}
+    else:
+        coverage = score_key_point_coverage(key_points, user_answer)
+        if not key_points or coverage["score"] < 1:
+            return None
+    missed = coverage["missed_points"]
+    if not user_answer.strip():
+        feedback = "No answer was given."
+    elif missed:
+        feedback = "Good answer, but it does not mention: " + "; ".join(missed) + "."
+    else:
+        feedback = "All key points are covered."
+    return {
+        "score": coverage["score"],
+        "coverage_percent": coverage["coverage_percent"],
+        "missing_points": missed,
+        "evaluation_feedback": feedback,
+        "correct_answer": correct_answer,
+    }
+
+async def agrade_answer(question, user_answer, mode="llm"):
+    """Grade one answer against a quiz question, reusing key points stored on the question."""
+    correct_answer = question["answer"]
+    key_points = question.get("key_points")
+    if key_points is None:
+        result_raw = await key_point_extractor.acall(answer=correct_answer)
+        key_points = question["key_points"] = clean_json_field(result_raw.key_points)
+
+    if mode == "local":
+        evaluation = local_evaluation(key_points, user_answer, correct_answer)
+        if evaluation is not None:
+            return evaluation
+
+    evaluator = AnswerEvaluator()
+    evaluation_json_raw = await evaluator.acall(user_answer=user_answer, keypoints=key_points, correct_answer=correct_answer)
+    return clean_json_field(evaluation_json_raw.evaluation_json)
@@ -1,4 +1,6 @@
-import dspy, re, json
+import dspy, re, json, os, asyncio
+from collections import Counter
+from backend.utils.concurrency import limiter
 
 def clean_json_field(field:str):
             field = re.sub(r"^```(?:json)?\n?", "", field.strip())
@@ -26,6 +28,85 @@ class MindmapExtractor(dspy.Module):
     def forward(self, transcript: str):
         return self.teleprompt(transcript=transcript)
 
+    async def aforward(self, transcript: str):
+        async with limiter("llm"):
+            return await self.teleprompt.acall(transcript=transcript)
+
+# ----------------------------------------------------------
+# WINDOWED EXTRACTION FOR LONG / MULTI-SOURCE SESSIONS
+# ----------------------------------------------------------
+MINDMAP_WINDOW_CHARS = int(os.getenv("MINDMAP_WINDOW_CHARS", "40000"))
+
+def parse_extraction(result) -> dict:
+    return {"central_topic": result.central_topic, "subtopics": clean_json_field(result.subtopics)}
+
+def window_transcript(texts, max_chars=MINDMAP_WINDOW_CHARS):
+    """Pack segment texts, in order, into transcript windows of at most ~max_chars."""
+    windows, current, current_len = [], [], 0
+    for t in texts:
+        if current and current_len + len(t) + 1 > max_chars:
+            windows.append(" ".join(current))
+            current, current_len = [], 0
+        current.append(t)
+        current_len += len(t) + 1
+    if current:
+        windows.append(" ".join(current))
+    return windows
+
+def _norm_title(title) -> str:
+    return re.sub(r"[^\w\s]", "", str(title)).strip().lower()
+
+def _merge_subtopics(into: list, incoming: list):
+    by_title = {_norm_title(t.get("title", "")): t for t in into}
+    for topic in incoming:
+        if not isinstance(topic, dict) or not topic.get("title"):
+            continue
+        key = _norm_title(topic["title"])
+        existing = by_title.get(key)
+        if existing is None:
+            node = {"title": topic["title"], "description": topic.get("description", "")}
+            into.append(node)
+            by_title[key] = node
+            existing = node
+        elif len(topic.get("description") or "") > len(existing.get("description") or ""):
+            existing["description"] = topic["description"]
+        if topic.get("children"):
+            _merge_subtopics(existing.setdefault("children", []), topic["children"])
+
+def merge_topic_trees(trees) -> dict:
+    """
+    Merge per-window extractions into one tree. The central topic is the
+    most frequent one across windows (earliest wins ties); subtopics with
+    the same normalized title are merged recursively, in first-seen order.
+    """
+    counts = Counter(_norm_title(t["central_topic"]) for t in trees)
+    best = max(counts.values())
+    central = next(t["central_topic"] for t in trees if counts[_norm_title(t["central_topic"])] == best)
+
+    subtopics = []
+    for t in trees:
+        _merge_subtopics(subtopics, t.get("subtopics") or [])
+    return {"central_topic": central, "subtopics": subtopics}
+
+async def aextract_topics_windowed(texts, max_chars=MINDMAP_WINDOW_CHARS) -> dict:
+    """Extract a tree per window concurrently, then merge; latency is bounded by the slowest window."""
+    windows = window_transcript(texts, max_chars)
+    extractor = MindmapExtractor()
+    results = await asyncio.gather(*(extractor.acall(transcript=w) for w in windows), return_exceptions=True)
+
+    trees, errors = [], []
+    for r in results:
+        if isinstance(r, Exception):
+            errors.append(r)
+            continue
+        try:
+            trees.append(parse_extraction(r))
+        except ValueError as e:
+            errors.append(e)
+    if not trees:
+        raise errors[0]
+    return merge_topic_trees(trees)
+
 class KeyPointExtractorSignature(dspy.Signature):
     answer = dspy.InputField(desc="The correct answer for a quiz question.")
     key_points = dspy.OutputField(
@@ -45,6 +126,10 @@ class KeyPointExtractor(dspy.Module):
 
     def forward(self, answer: str):
         return self.generator(answer=answer)
+
+    async def aforward(self, answer: str):
+        async with limiter("llm"):
+            return await self.generator.acall(answer=answer)
     
 key_point_extractor = KeyPointExtractor()
 
@@ -53,9 +138,7 @@ def extract_key_points(answer: str):
     raw = result.key_points
     return clean_json_field(raw)
 
-def evaluate_answer(correct_answer, user_answer):
-    expected_points = extract_key_points(correct_answer)
-
+def score_key_point_coverage(expected_points, user_answer):
     matched = 0
     missed = []
 
@@ -67,7 +150,7 @@ def evaluate_answer(correct_answer, user_answer):
         else:
             missed.append(p)
 
-    coverage = matched / len(expected_points)
+    coverage = matched / len(expected_points) if expected_points else 0
 
     if coverage < 0.5:
         score = 0
@@ -86,3 +169,18 @@ def evaluate_answer(correct_answer, user_answer):
         "status": status
     }
 
+def evaluate_answer(correct_answer, user_answer):
+    expected_points = extract_key_points(correct_answer)
+    return score_key_point_coverage(expected_points, user_answer)
+
+async def aextract_key_points_batch(answers):
+    """
+    Key points for many reference answers at once, extracted concurrently.
+    An answer whose extraction fails maps to None so it can be retried lazily.
+    """
+    async def extract(answer):
+        result = await key_point_extractor.acall(answer=answer)
+        return clean_json_field(result.key_points)
+
+    results = await asyncio.gather(*(extract(a) for a in answers), return_exceptions=True)
+    return [None if isinstance(r, Exception) else r for r in results]
@@ -1,10 +1,16 @@
 import google.generativeai as genai
+import asyncio
 import os
+from backend.utils import gemini_client
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Rough prompt budget per map call; ~4 characters per token for English text
+NOTES_CHUNK_TOKENS = int(os.getenv("NOTES_CHUNK_TOKENS", "24000"))
+CHARS_PER_TOKEN = 4
+
 PROMPT_NOTES = """
 You are an AI study assistant tasked with creating **exam-ready, structured, and comprehensive study notes**.
 
@@ -41,12 +47,188 @@ Context:
 Notes:
 """
 
+PROMPT_PARTIAL_NOTES = """
+You are an AI study assistant. The material below is part {part} of {total} of a longer set of sources.
+Write **structured Markdown study notes for this part only**, following these rules:
+
+- Cover **every** concept, definition, formula, step and example that appears in this part. Do not skip anything.
+- Use H2/H3 headings named after the topics, bullet points and tables where helpful.
+- Base notes **ONLY** on the context below. Do not add external information.
+- Do not write an introduction or conclusion for the whole subject; other parts are handled separately.
+
+Context:
+{context}
+
+Notes:
+"""
+
+PROMPT_MERGE_NOTES = """
+You are an AI study assistant. Below are partial study notes, written in order from consecutive parts of the same material.
+Merge them into **one unified, exam-ready Markdown document**:
+
+- Keep **all** information from every part. Never drop a definition, formula, example or step.
+- Remove only exact duplicates, and combine sections that cover the same topic.
+- Reorganize into a single clean hierarchy (H1 title, H2/H3 sections) that follows the topic flow.
+- Use consistent formatting: bullet points, numbered lists, tables, and blank lines between sections.
+- Do NOT introduce facts that are not in the partial notes.
+
+Partial notes:
+{notes}
+
+Notes:
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_segments(segments) -> str:
+    """Render segments as plain text grouped under one header per source, in order of first appearance."""
+    by_source = {}
+    for s in segments:
+        if s.get("text"):
+            key = (s.get("source_type", "unknown"), s.get("source_id", ""))
+            by_source.setdefault(key, []).append(s["text"])
+    return "\n\n".join(
+        f"## Source: {src} {sid}\n" + "\n".join(texts) for (src, sid), texts in by_source.items()
+    )
+
+
+def plan_note_chunks(segments, max_tokens=NOTES_CHUNK_TOKENS):
+    """
+    Group segments by source (keeping their order) and pack them into
+    contexts of at most ~max_tokens. Oversized segments are split, never
+    truncated, so every character of input lands in exactly one chunk.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    by_source = {}
+    for s in segments:
+        if s.get("text"):
+            key = (s.get("source_type", "unknown"), s.get("source_id", ""))
+            by_source.setdefault(key, []).append(s["text"])
+
+    chunks = []
+    current, current_len, current_source = [], 0, None
+
+    def flush():
+        nonlocal current, current_len, current_source
+        if current:
+            chunks.append("\n".join(current))
+        current, current_len, current_source = [], 0, None
+
+    for (src, sid), texts in by_source.items():
+        header = f"## Source: {src} {sid}"
+        for text in texts:
+            pieces = [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+            for piece in pieces:
+                needs_header = current_source != (src, sid)
+                extra = len(piece) + 1 + (len(header) + 1 if needs_header else 0)
+                if current and current_len + extra > max_chars:
+                    flush()
+                    needs_header = True
+                    extra = len(piece) + len(header) + 2
+                if needs_header:
+                    current.append(header)
+                    current_source = (src, sid)
+                current.append(piece)
+                current_len += extra
+    flush()
+    return chunks
+
 
 def generate_notes_from_transcripts(text):
     text = text
 
     prompt = PROMPT_NOTES.format(context=text)
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt)
-    return response.text
+    return gemini_client.generate(prompt, "gemini-2.0-flash")
+
+
+async def _agenerate(prompt):
+    return await gemini_client.agenerate(prompt, "gemini-2.0-flash")
+
+
+async def agenerate_notes_from_transcripts(text):
+    return await _agenerate(PROMPT_NOTES.format(context=text))
+
+
+async def _astream(prompt):
+    async for text in gemini_client.astream(prompt, "gemini-2.0-flash"):
+        yield text
+
+
+async def astream_notes_from_transcripts(text):
+    """Yield the notes markdown chunk by chunk as the model produces it."""
+    async for piece in _astream(PROMPT_NOTES.format(context=text)):
+        yield piece
+
+
+# ----------------------------------------------------------
+# MAP-REDUCE NOTES FOR LARGE SESSIONS
+# ----------------------------------------------------------
+def _group_by_budget(notes, max_tokens):
+    # at least two partials per group so every reduce level shrinks the list
+    groups, current, current_tokens = [], [], 0
+    for n in notes:
+        t = estimate_tokens(n)
+        if len(current) >= 2 and current_tokens + t > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(n)
+        current_tokens += t
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def _merge_prompt(notes):
+    joined = "\n\n".join(f"--- Part {i + 1} ---\n{n}" for i, n in enumerate(notes))
+    return PROMPT_MERGE_NOTES.format(notes=joined)
+
+
+async def _amap_and_reduce(segments, max_tokens):
+    """Map every chunk in parallel, then reduce level by level until one merge call remains."""
+    chunks = plan_note_chunks(segments, max_tokens)
+    if len(chunks) <= 1:
+        return None, chunks
+
+    partials = await asyncio.gather(*(
+        _agenerate(PROMPT_PARTIAL_NOTES.format(part=i + 1, total=len(chunks), context=c))
+        for i, c in enumerate(chunks)
+    ))
+
+    groups = _group_by_budget(partials, max_tokens)
+    while len(groups) > 1:
+        partials = await asyncio.gather(*(_agenerate(_merge_prompt(g)) for g in groups))
+        groups = _group_by_budget(partials, max_tokens)
+    return groups[0], chunks
+
+
+async def agenerate_notes_map_reduce(segments, max_tokens=NOTES_CHUNK_TOKENS):
+    final_group, chunks = await _amap_and_reduce(segments, max_tokens)
+    if final_group is None:
+        return await agenerate_notes_from_transcripts(chunks[0] if chunks else "")
+    return await _agenerate(_merge_prompt(final_group))
+
+
+async def astream_notes_map_reduce(segments, max_tokens=NOTES_CHUNK_TOKENS):
+    """Same as agenerate_notes_map_reduce, but the final merge is streamed."""
+    final_group, chunks = await _amap_and_reduce(segments, max_tokens)
+    if final_group is None:
+        stream = _astream(PROMPT_NOTES.format(context=chunks[0] if chunks else ""))
+    else:
+        stream = _astream(_merge_prompt(final_group))
+    async for piece in stream:
+        yield piece
+
+
+def use_map_reduce(segments, mode="auto", max_tokens=NOTES_CHUNK_TOKENS) -> bool:
+    if mode == "map_reduce":
+        return True
+    if mode == "single":
+        return False
+    return estimate_tokens(format_segments(segments)) > max_tokens
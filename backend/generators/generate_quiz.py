@@ -1,7 +1,10 @@
-import google.generativeai as genai
-import json, re, os
+import asyncio, json, re, os
+from backend.utils import gemini_client
+from backend.utils.rag_agent import aembed_queries, format_context
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+QUIZ_TOPIC_RESULTS = int(os.getenv("QUIZ_TOPIC_RESULTS", "6"))
+QUIZ_MODES = ("auto", "full", "per_topic")
 
 PROMPT_QUIZ = """
 Generate {num_questions} high-quality, professional quiz questions at a {difficulty} difficulty level, with {type} type of answers, suitable for university or school exams.
@@ -35,6 +38,39 @@ Raw Context:
 JSON Output:
 """
 
+PROMPT_QUIZ_TOPIC = """
+Generate {num_questions} high-quality, professional quiz questions at a {difficulty} difficulty level, with {type} type of answers, suitable for university or school exams.
+All questions must be about the topic "{topic}".
+
+Rules:
+- Base questions ONLY on the context below.
+- Use both the topic structure AND the retrieved excerpts.
+- Questions must be **conceptual, relevant, and exam-appropriate**.
+- Avoid trivial, opinion-based, or meta-level questions.
+- Each question should test understanding, application, or reasoning based on the context.
+- Do NOT introduce any new facts or external information.
+- Return VALID JSON ONLY.
+
+JSON Format:
+[
+  {{
+    "question_num": 1,
+    "question": "the question text",
+    "topic": "{topic}",
+    "subtopic": "subtopic (or null)",
+    "answer": "answer strictly from context"
+  }}
+]
+
+Topic Structure (JSON):
+{extracted}
+
+Retrieved Excerpts:
+{context}
+
+JSON Output:
+"""
+
 def clean_json_field(field:str):
             field = re.sub(r"^```(?:json)?\n?", "", field.strip())
             field = re.sub(r"\n?```$", "", field)
@@ -52,8 +88,74 @@ def generate_quiz_from_transcripts(transcript, topics_json, num_questions=5, dif
 
     )
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt)
-    raw_output = response.text.strip()
+    raw_output = gemini_client.generate(prompt, "gemini-2.0-flash").strip()
     clean_output = clean_json_field(raw_output)
     return clean_output
+
+
+async def agenerate_quiz_from_transcripts(transcript, topics_json, num_questions=5, difficulty="medium", type="short"):
+    prompt = PROMPT_QUIZ.format(
+        num_questions=num_questions,
+        context=transcript,
+        extracted=json.dumps(topics_json, indent=2),
+        difficulty=difficulty,
+        type=type
+    )
+
+    raw_output = (await gemini_client.agenerate(prompt, "gemini-2.0-flash")).strip()
+    return clean_json_field(raw_output)
+
+
+# ----------------------------------------------------------
+# RETRIEVAL-SCOPED QUIZ, ONE PROMPT PER TOPIC
+# ----------------------------------------------------------
+def allocate_questions(topics, num_questions):
+    """Spread num_questions over the topics round-robin; topics that get none are left out."""
+    counts = [0] * len(topics)
+    for i in range(num_questions):
+        counts[i % len(topics)] += 1
+    return [(t, c) for t, c in zip(topics, counts) if c]
+
+async def agenerate_quiz_per_topic(collection, topics_json, num_questions=5, difficulty="medium", type="short", n_results=QUIZ_TOPIC_RESULTS):
+    """
+    Returns (quiz, failed_topics): topics whose generation failed are left
+    out of the quiz and listed by title. Raises if every topic fails.
+    """
+    topics = [t for t in topics_json.get("subtopics") or [] if isinstance(t, dict) and t.get("title")]
+    if not topics:
+        raise ValueError("No subtopics to generate questions for")
+    plan = allocate_questions(topics, num_questions)
+
+    # one embedding call and one Chroma query for every topic at once
+    queries = [f"{t['title']}: {t.get('description', '')}" for t, _ in plan]
+    embeddings = await aembed_queries(queries)
+    res = await asyncio.to_thread(collection.query, query_embeddings=embeddings, n_results=n_results)
+
+    async def generate_for(i, topic, count):
+        prompt = PROMPT_QUIZ_TOPIC.format(
+            num_questions=count,
+            topic=topic["title"],
+            extracted=json.dumps(topic, indent=2),
+            context=format_context(res["documents"][i], res["metadatas"][i]),
+            difficulty=difficulty,
+            type=type
+        )
+        return clean_json_field((await gemini_client.agenerate(prompt, "gemini-2.0-flash")).strip())
+
+    results = await asyncio.gather(*(generate_for(i, t, c) for i, (t, c) in enumerate(plan)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if len(errors) == len(results):
+        raise errors[0]
+
+    quiz = []
+    failed_topics = []
+    for (topic, _), questions in zip(plan, results):
+        if isinstance(questions, Exception):
+            failed_topics.append(topic["title"])
+            continue
+        for q in questions:
+            q.setdefault("topic", topic["title"])
+            quiz.append(q)
+    for n, q in enumerate(quiz, start=1):
+        q["question_num"] = n
+    return quiz, failed_topics
@@ -1,4 +1,7 @@
-from graphviz import Digraph
+import os
+from backend.generators.mindmap_svg import render_mindmap_svg
+
+MINDMAP_RENDERER = os.getenv("MINDMAP_RENDERER", "graphviz")
 
 def escape_label(text: str) -> str:
     """Escape special characters for Graphviz HTML-like labels."""
@@ -22,6 +25,9 @@ def generate_mindmap_svg_from_json(data: dict) -> str:
     Returns SVG string (UTF-8), safe for direct rendering in HTML/React.
     """
 
+    # imported here so the native renderer works in images without Graphviz
+    from graphviz import Digraph
+
     dot = Digraph(comment=f"Mindmap: {data['central_topic']}", format='svg')
 
     # Graph and node default attributes
@@ -70,3 +76,15 @@ def generate_mindmap_svg_from_json(data: dict) -> str:
     svg_clean = svg_text.replace('\r', '').replace('\n', '')
 
     return svg_clean
+
+
+# "graphviz" forks `dot` per render; "native" lays the tree out in-process
+MINDMAP_RENDERERS = {
+    "graphviz": generate_mindmap_svg_from_json,
+    "native": render_mindmap_svg,
+}
+
+def render_mindmap(data: dict, renderer: str = MINDMAP_RENDERER) -> str:
+    if renderer not in MINDMAP_RENDERERS:
+        raise ValueError(f"renderer must be one of {list(MINDMAP_RENDERERS)}")
+    return MINDMAP_RENDERERS[renderer](data)
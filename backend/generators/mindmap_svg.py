@@ -0,0 +1,185 @@
+from typing import List
+from xml.sax.saxutils import escape
+
+FONT = "Arial"
+CENTRAL_FONT_SIZE = 13
+TITLE_FONT_SIZE = 10
+DESC_FONT_SIZE = 9
+
+# Graphviz defaults, in points
+MIN_WIDTH = 54      # 0.75in
+MIN_HEIGHT = 36     # 0.5in
+PAD_X = 8
+PAD_Y = 4
+RANK_SEP = 36       # ranksep 0.5in between columns
+NODE_SEP = 18       # nodesep 0.25in between siblings
+MARGIN = 4
+ARROW_LEN = 10
+
+
+def _text_width(text: str, size: float, bold: bool = False) -> float:
+    # average Arial advance; good enough to size boxes without font metrics
+    return len(text) * size * (0.6 if bold else 0.52)
+
+
+def _attr(text: str) -> str:
+    return escape(text, {'"': "&quot;"})
+
+
+class _Node:
+    __slots__ = ("id", "title", "desc", "children", "central", "w", "h", "x", "y")
+
+    def __init__(self, node_id: str, title: str, desc: str = "", central: bool = False):
+        self.id = node_id
+        self.title = title
+        self.desc = desc.strip()
+        self.central = central
+        self.children: List["_Node"] = []
+        if central:
+            tw = _text_width(title, CENTRAL_FONT_SIZE, bold=True)
+            # an ellipse around the text box needs about sqrt(2) more room
+            self.w = max(MIN_WIDTH, (tw + 2 * PAD_X) * 1.42)
+            self.h = max(MIN_HEIGHT, (CENTRAL_FONT_SIZE + 2 * PAD_Y) * 1.42)
+        else:
+            tw = _text_width(title, TITLE_FONT_SIZE, bold=True)
+            if self.desc:
+                tw = max(tw, _text_width(self.desc, DESC_FONT_SIZE))
+            lines = TITLE_FONT_SIZE + (DESC_FONT_SIZE + 3 if self.desc else 0)
+            self.w = max(MIN_WIDTH, tw + 2 * PAD_X)
+            self.h = max(MIN_HEIGHT, lines + 2 * PAD_Y)
+        self.x = self.y = 0.0
+
+
+def build_tree(data: dict) -> _Node:
+    """Same node ids as the Graphviz renderer: "central", then "{parent}_{n}" in pre-order."""
+    root = _Node("central", data["central_topic"], central=True)
+    count = 1
+    # explicit stack of iterators keeps deep trees clear of the recursion limit
+    stack = [(root, iter(data.get("subtopics", [])))]
+    while stack:
+        parent, topics = stack[-1]
+        topic = next(topics, None)
+        if topic is None:
+            stack.pop()
+            continue
+        node = _Node(f"{parent.id}_{count}", topic["title"], topic.get("description", ""))
+        count += 1
+        parent.children.append(node)
+        if topic.get("children"):
+            stack.append((node, iter(topic["children"])))
+    return root
+
+
+def layout(root: _Node):
+    """
+    Tidy left-to-right layout: each depth is a column as wide as its widest
+    node, leaves are stacked top to bottom and every parent is centred on its
+    children, so subtrees never overlap. Returns (width, height).
+    """
+    columns: List[float] = []
+    order = []  # (node, depth) in pre-order
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        order.append((node, depth))
+        if depth == len(columns):
+            columns.append(0.0)
+        columns[depth] = max(columns[depth], node.w)
+        stack.extend((c, depth + 1) for c in reversed(node.children))
+
+    col_x = []
+    x = MARGIN
+    for w in columns:
+        col_x.append(x)
+        x += w + RANK_SEP
+    width = x - RANK_SEP + MARGIN
+
+    # y: leaves in pre-order, parents centred on their first and last child (post-order)
+    cursor = [MARGIN]
+    for node, depth in order:
+        node.x = col_x[depth] + (columns[depth] - node.w) / 2 if node.central else col_x[depth]
+        if not node.children:
+            node.y = cursor[0] + node.h / 2
+            cursor[0] += node.h + NODE_SEP
+    for node, _ in reversed(order):
+        if node.children:
+            node.y = (node.children[0].y + node.children[-1].y) / 2
+    height = cursor[0] - NODE_SEP + MARGIN
+    return width, height
+
+
+def _node_svg(node: _Node, index: int) -> str:
+    cx = node.x + node.w / 2
+    parts = [f'<g id="node{index}" class="node"><title>{_attr(node.id)}</title>']
+    if node.central:
+        parts.append(
+            f'<ellipse fill="#ffebcd" stroke="black" cx="{cx:.2f}" cy="{node.y:.2f}" rx="{node.w / 2:.2f}" ry="{node.h / 2:.2f}"/>'
+            f'<text text-anchor="middle" x="{cx:.2f}" y="{node.y + CENTRAL_FONT_SIZE * 0.35:.2f}" '
+            f'font-family="{FONT}" font-weight="bold" font-size="{CENTRAL_FONT_SIZE:.2f}">{_attr(node.title)}</text>'
+        )
+    else:
+        top, bottom = node.y - node.h / 2, node.y + node.h / 2
+        right = node.x + node.w
+        parts.append(
+            f'<polygon fill="#f0f8ff" stroke="black" points="{right:.2f},{top:.2f} {node.x:.2f},{top:.2f} '
+            f'{node.x:.2f},{bottom:.2f} {right:.2f},{bottom:.2f} {right:.2f},{top:.2f}"/>'
+        )
+        if node.desc:
+            title_y = node.y - 1.5
+            desc_y = node.y + DESC_FONT_SIZE + 0.5
+        else:
+            title_y = node.y + TITLE_FONT_SIZE * 0.35
+        parts.append(
+            f'<text text-anchor="middle" x="{cx:.2f}" y="{title_y:.2f}" font-family="{FONT}" '
+            f'font-weight="bold" font-size="{TITLE_FONT_SIZE:.2f}">{_attr(node.title)}</text>'
+        )
+        if node.desc:
+            parts.append(
+                f'<text text-anchor="middle" x="{cx:.2f}" y="{desc_y:.2f}" font-family="{FONT}" '
+                f'font-size="{DESC_FONT_SIZE:.2f}">{_attr(node.desc)}</text>'
+            )
+    parts.append("</g>")
+    return "".join(parts)
+
+
+def _edge_svg(parent: _Node, child: _Node, index: int) -> str:
+    # cubic curve from the parent's right side to just before the child's left side, then the arrowhead
+    x1, y1 = parent.x + parent.w, parent.y
+    x2, y2 = child.x, child.y
+    xa = x2 - ARROW_LEN
+    mid = (x1 + xa) / 2
+    return (
+        f'<g id="edge{index}" class="edge"><title>{_attr(parent.id)}&#45;&gt;{_attr(child.id)}</title>'
+        f'<path fill="none" stroke="black" d="M{x1:.2f},{y1:.2f}C{mid:.2f},{y1:.2f} {mid:.2f},{y2:.2f} {xa:.2f},{y2:.2f}"/>'
+        f'<polygon fill="black" stroke="black" points="{xa:.2f},{y2 - 3.5:.2f} {x2:.2f},{y2:.2f} {xa:.2f},{y2 + 3.5:.2f} {xa:.2f},{y2 - 3.5:.2f}"/>'
+        f'</g>'
+    )
+
+
+def render_mindmap_svg(data: dict) -> str:
+    """
+    Lay out and render the mindmap JSON as a single-line SVG string in the
+    Graphviz renderer's style, without spawning `dot`.
+    """
+    root = build_tree(data)
+    width, height = layout(root)
+
+    nodes, edges = [], []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(_node_svg(node, len(nodes) + 1))
+        for child in node.children:
+            edges.append(_edge_svg(node, child, len(edges) + 1))
+        stack.extend(reversed(node.children))
+
+    return (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+        f'<svg width="{width:.0f}pt" height="{height:.0f}pt" viewBox="0.00 0.00 {width:.2f} {height:.2f}" '
+        f'xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+        f'<g id="graph0" class="graph">'
+        f'<title>{_attr("Mindmap: " + data["central_topic"])}</title>'
+        f'<polygon fill="white" stroke="none" points="0,0 0,{height:.2f} {width:.2f},{height:.2f} {width:.2f},0 0,0"/>'
+        + "".join(edges) + "".join(nodes) +
+        "</g></svg>"
+    )
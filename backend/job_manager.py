@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))  # finished jobs are kept this long for status polling
+
+# In-memory job store:
+# job_store[job_id] = {
+#   "job_id", "session_id", "kind",
+#   "status": "queued" | "running" | "completed" | "failed",
+#   "stage": str, "progress": 0-100,
+#   "result": dict | None, "error": str | None,
+#   "created_at", "updated_at"
+# }
+job_store = {}
+
+_queue = None
+_workers = []
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def set_stage(job, stage, progress=None):
+    """Record the current stage; a no-op for work that runs inline without a job."""
+    if job is None:
+        return
+    job["stage"] = stage
+    if progress is not None:
+        job["progress"] = max(0, min(100, int(progress)))
+    job["updated_at"] = time.time()
+
+
+def _purge_finished():
+    cutoff = time.time() - JOB_TTL
+    for job_id, job in list(job_store.items()):
+        if job["status"] in ("completed", "failed") and job["updated_at"] < cutoff:
+            del job_store[job_id]
+
+
+def submit_job(session_id, kind, work):
+    """
+    Queue `work(job)` (a coroutine function) and return the job id immediately.
+    Raises JobQueueFull when the backlog is at JOB_QUEUE_MAX.
+    """
+    _purge_finished()
+    now = time.time()
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "session_id": session_id,
+        "kind": kind,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    try:
+        _queue.put_nowait((job, work))
+    except asyncio.QueueFull:
+        raise JobQueueFull(f"Job queue is full ({JOB_QUEUE_MAX} pending)")
+    job_store[job["job_id"]] = job
+    return job["job_id"]
+
+
+def get_job(job_id):
+    return job_store.get(job_id)
+
+
+async def _worker():
+    while True:
+        job, work = await _queue.get()
+        job["status"] = "running"
+        set_stage(job, "running", 0)
+        try:
+            job["result"] = await work(job)
+            job["status"] = "completed"
+            set_stage(job, "done", 100)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job["job_id"], job["kind"])
+            job["status"] = "failed"
+            job["error"] = str(e)
+            job["updated_at"] = time.time()
+        finally:
+            _queue.task_done()
+
+
+def start_job_workers(n_workers=JOB_WORKERS):
+    """Start the bounded worker pool on the running event loop (call once at startup)."""
+    global _queue
+    _queue = asyncio.Queue(maxsize=JOB_QUEUE_MAX)
+    for _ in range(n_workers):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_job_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import shutil
 from pathlib import Path
@@ -6,9 +7,12 @@ BASE_TEMP_DIR = Path("/tmp/rag_sessions")
 
 # In-memory session store:
 # session_store[session_id] = {
-#   "segments": [ {text, source_type, source_id, start, end, page, chunk_index} ],
+#   "segments": [ {text, source_type, source_id, ingest_id, start, end, page, chunk_index} ],
 #   "collection": chroma_collection_obj,
 #   "client": chroma_client_obj,
+#   "indexed": { segment_id: text_hash },  # watermark of what is in the collection
+#   "index_fingerprint": str,  # hash of the watermark, scopes the answer cache
+#   "index_lock": asyncio.Lock,  # serializes index builds, source deletes and replaces
 #   "metadata": { ... }
 # }
 session_store = {}
@@ -21,6 +25,9 @@ def create_session():
         "segments": [],
         "collection": None,
         "client": None,
+        "indexed": {},
+        "index_fingerprint": None,
+        "index_lock": asyncio.Lock(),
         "metadata": {}
     }
     return session_id
@@ -34,3 +41,14 @@ def delete_session(session_id):
     if path.exists():
         shutil.rmtree(path)
     return bool(sess)
+
+def remove_source_segments(sess, source_id, source_type=None):
+    """Drop every segment of one source from the session; returns the removed segments."""
+    kept, removed = [], []
+    for s in sess["segments"]:
+        if s.get("source_id") == source_id and (source_type is None or s.get("source_type") == source_type):
+            removed.append(s)
+        else:
+            kept.append(s)
+    sess["segments"] = kept
+    return removed
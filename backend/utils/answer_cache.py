@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SEMANTIC = os.getenv("ANSWER_CACHE_SEMANTIC", "0") == "1"
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+# most recent questions per fingerprint that semantic lookups compare against
+ANSWER_CACHE_SEMANTIC_CANDIDATES = int(os.getenv("ANSWER_CACHE_SEMANTIC_CANDIDATES", "512"))
+
+
+def normalize_question(question: str) -> str:
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip("?!. ")
+
+
+def _normalize(embeddings) -> np.ndarray:
+    # rows scaled to unit length, so cosine similarity is a plain dot product
+    m = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of /ask responses. Entries are scoped by the fingerprint
+    of the collection they were answered from, so identical material shared
+    by many sessions shares answers and any index change makes old entries
+    unreachable. Semantic lookups compare unit-normalized query embeddings
+    against the most recent `semantic_candidates` questions of one
+    fingerprint; the matrix product runs outside the lock.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: int = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD,
+                 semantic_candidates: int = ANSWER_CACHE_SEMANTIC_CANDIDATES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.semantic_candidates = semantic_candidates
+        self._entries = OrderedDict()  # key -> (expires_at, fingerprint, value)
+        self._by_fingerprint: Dict[str, set] = {}
+        self._semantic: Dict[str, OrderedDict] = {}  # fingerprint -> {key: normalized embedding}
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(fingerprint: str, question: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\x00{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _drop(self, key):
+        _, fp, _ = self._entries.pop(key)
+        keys = self._by_fingerprint.get(fp)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_fingerprint[fp]
+        vectors = self._semantic.get(fp)
+        if vectors is not None:
+            vectors.pop(key, None)
+            if not vectors:
+                del self._semantic[fp]
+
+    def get_exact(self, fingerprint: str, question: str) -> Optional[dict]:
+        key = self.key(fingerprint, question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return entry[2]
+
+    def get_semantic(self, fingerprint: str, embedding: List[float]) -> Optional[dict]:
+        return self.get_semantic_many(fingerprint, [embedding])[0]
+
+    def get_semantic_many(self, fingerprint: str, embeddings: List[List[float]]) -> List[Optional[dict]]:
+        """
+        Best cached answer above the threshold for each embedding, or None.
+        CPU-bound for large fingerprints: call it from a worker thread.
+        """
+        if not embeddings:
+            return []
+        with self._lock:
+            vectors = self._semantic.get(fingerprint)
+            if not vectors:
+                return [None] * len(embeddings)
+            keys = list(vectors)
+            matrix = np.stack(list(vectors.values()))
+
+        scores = _normalize(embeddings) @ matrix.T
+
+        results = []
+        with self._lock:
+            now = time.time()
+            for row in scores:
+                hit = None
+                candidates = np.flatnonzero(row >= self.threshold)
+                for j in candidates[np.argsort(-row[candidates])]:
+                    entry = self._entries.get(keys[j])
+                    if entry is None:
+                        continue
+                    if entry[0] < now:
+                        self._drop(keys[j])
+                        continue
+                    self._entries.move_to_end(keys[j])
+                    self.counters["semantic_hits"] += 1
+                    hit = entry[2]
+                    break
+                results.append(hit)
+        return results
+
+    def record_miss(self):
+        with self._lock:
+            self.counters["misses"] += 1
+
+    def put(self, fingerprint: str, question: str, value: dict, embedding: Optional[List[float]] = None):
+        if self.max_entries <= 0:
+            return
+        key = self.key(fingerprint, question)
+        vector = _normalize(embedding)[0] if embedding is not None and self.semantic_candidates > 0 else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + self.ttl, fingerprint, value)
+            self._by_fingerprint.setdefault(fingerprint, set()).add(key)
+            if vector is not None:
+                vectors = self._semantic.setdefault(fingerprint, OrderedDict())
+                vectors[key] = vector
+                while len(vectors) > self.semantic_candidates:
+                    vectors.popitem(last=False)  # stays answerable by exact match
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, fingerprint: str):
+        with self._lock:
+            for key in list(self._by_fingerprint.get(fingerprint, ())):
+                self._drop(key)
+                self.counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+            size = len(self._entries)
+        lookups = c["exact_hits"] + c["semantic_hits"] + c["misses"]
+        hits = c["exact_hits"] + c["semantic_hits"]
+        return {**c, "entries": size, "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+
+
+answer_cache = AnswerCache()
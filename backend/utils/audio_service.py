@@ -1,14 +1,84 @@
 import requests
+import asyncio
+import httpx
 import time
 import os
+from typing import Dict, List, Optional
+from backend.utils.concurrency import limiter
 
 ASSEMBLY_API_KEY = os.getenv("ASSEMBLY_API_KEY")
-BASE_URL = "https://api.assemblyai.com"
+BASE_URL = os.getenv("ASSEMBLY_BASE_URL", "https://api.assemblyai.com")
+
+TRANSCRIBE_POLL_INITIAL = float(os.getenv("TRANSCRIBE_POLL_INITIAL", "1"))
+TRANSCRIBE_POLL_FACTOR = float(os.getenv("TRANSCRIBE_POLL_FACTOR", "1.5"))
+TRANSCRIBE_POLL_MAX = float(os.getenv("TRANSCRIBE_POLL_MAX", "15"))
+TRANSCRIBE_MAX_WAIT = float(os.getenv("TRANSCRIBE_MAX_WAIT", "14400"))  # seconds; 0 waits forever
+TRANSCRIBE_POLL_RETRIES = int(os.getenv("TRANSCRIBE_POLL_RETRIES", "5"))
+AUDIO_SEGMENT_SECONDS = float(os.getenv("AUDIO_SEGMENT_SECONDS", "60"))
 
 headers = {
     "authorization": ASSEMBLY_API_KEY
 }
 
+
+# ----------------------------------------------------------
+# WORD TIMESTAMPS -> TIME-WINDOWED SEGMENTS
+# ----------------------------------------------------------
+def words_to_segments(words: List[Dict], source_id: str, window_seconds: float = AUDIO_SEGMENT_SECONDS) -> List[Dict]:
+    """
+    Group word-level results ({"text", "start", "end"} in milliseconds) into
+    segments of about window_seconds, with start/end in seconds like the
+    YouTube segments.
+    """
+    segments = []
+    current = []
+
+    def flush():
+        segments.append({
+            "source_type": "audio",
+            "source_id": source_id,
+            "start": current[0]["start"] / 1000,
+            "end": current[-1]["end"] / 1000,
+            "chunk_index": len(segments),
+            "text": " ".join(w["text"] for w in current),
+        })
+        current.clear()
+
+    for w in words:
+        if current and w["start"] - current[0]["start"] >= window_seconds * 1000:
+            flush()
+        current.append(w)
+    if current:
+        flush()
+    return segments
+
+
+def result_to_segments(result: Dict, source_id: str, window_seconds: float = AUDIO_SEGMENT_SECONDS) -> List[Dict]:
+    words = result.get("words") or []
+    if words:
+        return words_to_segments(words, source_id, window_seconds)
+    # no word timings (e.g. silent audio): keep whatever text came back
+    text = (result.get("text") or "").strip()
+    if not text:
+        return []
+    return [{"source_type": "audio", "source_id": source_id, "chunk_index": 0, "text": text}]
+
+
+def poll_intervals(initial: float = TRANSCRIBE_POLL_INITIAL, factor: float = TRANSCRIBE_POLL_FACTOR,
+                   maximum: float = TRANSCRIBE_POLL_MAX):
+    # short jobs finish in a few seconds, hour-long lectures take minutes: back off geometrically
+    delay = initial
+    while True:
+        yield delay
+        delay = min(maximum, delay * factor)
+
+
+def _check_result(result: Dict) -> bool:
+    if result["status"] == "error":
+        raise RuntimeError(f"Transcription failed: {result['error']}")
+    return result["status"] == "completed"
+
+
 def transcribe(audio_path):
     # Upload audio
     with open(audio_path, "rb") as f:
@@ -31,18 +101,103 @@ def transcribe(audio_path):
     transcript_id = response.json()['id']
 
     polling_endpoint = f"{BASE_URL}/v2/transcript/{transcript_id}"
-    print(f"Polling for transcript ID: {transcript_id}")
-    for i in range(30):  # ~90 sec max
+    deadline = time.monotonic() + TRANSCRIBE_MAX_WAIT if TRANSCRIBE_MAX_WAIT > 0 else None
+    for delay in poll_intervals():
         result = requests.get(polling_endpoint, headers=headers).json()
-        print(f"[{i}] Status: {result['status']}")
-        if result['status'] == 'completed':
-            text = result['text']
-            return [{
-                "source_type": "audio",
-                "source_id": audio_path.name,
-                "text": text
-            }]
-        elif result['status'] == 'error':
-            raise RuntimeError(f"Transcription failed: {result['error']}")
-        time.sleep(3)
-    raise TimeoutError("Polling timed out after 90 seconds.")
\ No newline at end of file
+        if _check_result(result):
+            return result_to_segments(result, audio_path.name)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Transcript {transcript_id} not ready after {TRANSCRIBE_MAX_WAIT:.0f} seconds")
+        time.sleep(delay)
+
+
+# ----------------------------------------------------------
+# ASYNC TRANSCRIBER ON A POOLED CLIENT
+# ----------------------------------------------------------
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide client, so uploads and polls reuse pooled connections."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            headers=headers,
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+        )
+    return _client
+
+
+async def aclose_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _iter_file(path, chunk_size=1024 * 1024):
+    # stream the upload body instead of loading the recording into memory;
+    # reads happen on a worker thread so a slow disk never stalls the event loop
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def _apoll(client: httpx.AsyncClient, path: str) -> Dict:
+    # a dropped connection or a 5xx while waiting must not throw away a long transcription
+    for attempt in range(TRANSCRIBE_POLL_RETRIES + 1):
+        try:
+            response = await client.get(path)
+            if response.status_code < 500:
+                response.raise_for_status()
+                return response.json()
+            error = httpx.HTTPStatusError(f"{response.status_code} from {path}", request=response.request, response=response)
+        except httpx.TransportError as e:
+            error = e
+        if attempt == TRANSCRIBE_POLL_RETRIES:
+            raise error
+        await asyncio.sleep(min(TRANSCRIBE_POLL_MAX, TRANSCRIBE_POLL_INITIAL * 2 ** attempt))
+
+
+async def atranscribe(audio_path, client: Optional[httpx.AsyncClient] = None, on_status=None,
+                      max_wait: float = TRANSCRIBE_MAX_WAIT, window_seconds: float = AUDIO_SEGMENT_SECONDS):
+    """
+    Upload and transcribe a recording, returning time-windowed segments.
+    Only the upload holds a "transcription" slot; waiting for the result is
+    a cheap poll with growing intervals and no fixed ceiling beyond max_wait
+    (0 waits forever). on_status(status) is called whenever the status changes.
+    """
+    client = client or get_client()
+    async with limiter("transcription"):
+        # Upload audio
+        response = await client.post("/v2/upload", content=_iter_file(audio_path))
+        response.raise_for_status()
+        audio_url = response.json()["upload_url"]
+
+        # Request transcription
+        data = {
+            "audio_url": audio_url,
+            "speech_model": "universal"
+        }
+        response = await client.post("/v2/transcript", json=data)
+        response.raise_for_status()
+        transcript_id = response.json()['id']
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait if max_wait > 0 else None
+    status = None
+    for delay in poll_intervals():
+        result = await _apoll(client, f"/v2/transcript/{transcript_id}")
+        if on_status and result["status"] != status:
+            on_status(result["status"])
+        status = result["status"]
+        if _check_result(result):
+            return result_to_segments(result, audio_path.name, window_seconds)
+        if deadline is not None and loop.time() + delay > deadline:
+            raise TimeoutError(f"Transcript {transcript_id} not ready after {max_wait:.0f} seconds")
+        await asyncio.sleep(delay)
@@ -0,0 +1,38 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bounds on in-flight calls per upstream service, shared by all requests
+LIMITS = {
+    "llm": int(os.getenv("LLM_CONCURRENCY", "128")),
+    "embedding": int(os.getenv("EMBEDDING_CONCURRENCY", "32")),
+    "transcription": int(os.getenv("TRANSCRIPTION_CONCURRENCY", "16")),
+    "youtube": int(os.getenv("YOUTUBE_CONCURRENCY", "16")),
+    "render": int(os.getenv("RENDER_CONCURRENCY", str(os.cpu_count() or 1))),
+    # whole index builds; their embed calls are paced by gemini_client, not by "embedding"
+    "indexing": int(os.getenv("INDEXING_CONCURRENCY", "4")),
+}
+
+# Size of the pool that runs the remaining blocking calls (Chroma, pypdf, graphviz)
+BLOCKING_THREADS = int(os.getenv("BLOCKING_THREADS", "64"))
+
+_semaphores = {}
+
+
+def limiter(name: str) -> asyncio.Semaphore:
+    """Process-wide semaphore for one upstream service, e.g. `async with limiter("llm"):`."""
+    sem = _semaphores.get(name)
+    if sem is None:
+        sem = _semaphores[name] = asyncio.Semaphore(LIMITS[name])
+    return sem
+
+
+async def run_blocking(name: str, func, *args, **kwargs):
+    """Run a blocking call in a worker thread while holding the service's limiter."""
+    async with limiter(name):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def install_blocking_executor(loop: asyncio.AbstractEventLoop):
+    # the default executor is min(32, cpu + 4) threads, too small for hundreds of in-flight calls
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="lumos-blocking"))
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import math
+import os
+import re
+import threading
+from typing import List, Optional
+
+from backend.utils import gemini_client
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "384"))
+
+
+class ProviderMismatchError(ValueError):
+    """The collection was built with a different embedding provider than the server uses."""
+
+
+class EmbeddingProvider(ABC):
+    """
+    One embedding backend. `name` must change whenever vectors would change
+    (model, dimension, ...), since caches and collections are keyed by it.
+    """
+    name = "base"
+    dimension = 0
+    batch_size = 32      # texts per embedding call
+    max_workers = 1      # concurrent calls while indexing
+    max_batch = 100      # hard cap per call for query batches
+
+    def next_batch_size(self) -> int:
+        return self.batch_size
+
+    @abstractmethod
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_queries, texts)
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Calls go through gemini_client, which adapts concurrency and batch size to quota errors."""
+    name = f"gemini:{GEMINI_EMBEDDING_MODEL}"
+    dimension = 768
+    max_workers = gemini_client.GEMINI_EMBED_MAX_CONCURRENCY
+    max_batch = gemini_client.GEMINI_EMBED_MAX_BATCH
+
+    def next_batch_size(self) -> int:
+        return gemini_client.embed_batch_size.current()
+
+    def _embed(self, texts, task_type):
+        return gemini_client.embed(GEMINI_EMBEDDING_MODEL, texts, task_type)
+
+    async def _aembed(self, texts, task_type):
+        return await gemini_client.aembed(GEMINI_EMBEDDING_MODEL, texts, task_type)
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "retrieval_document")
+
+    def embed_queries(self, texts):
+        return self._embed(texts, "retrieval_query")
+
+    async def aembed_documents(self, texts):
+        return await self._aembed(texts, "retrieval_document")
+
+    async def aembed_queries(self, texts):
+        return await self._aembed(texts, "retrieval_query")
+
+
+class OnnxMiniLMEmbeddingProvider(EmbeddingProvider):
+    """all-MiniLM-L6-v2 on CPU through the ONNX runtime that chromadb already ships."""
+    name = "onnx:all-MiniLM-L6-v2"
+    dimension = 384
+    batch_size = 64
+    max_workers = 1  # onnxruntime already uses every core per call
+
+    def __init__(self):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        self._fn = ONNXMiniLM_L6_V2()
+
+    def embed_documents(self, texts):
+        return [[float(x) for x in v] for v in self._fn(list(texts))]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Dependency-free feature hashing of word unigrams and bigrams. Deterministic
+    across processes, so it suits tests and offline deployments.
+    """
+    batch_size = 256
+    max_batch = 10000
+
+    def __init__(self, dimension: int = HASHING_EMBEDDING_DIM):
+        self.dimension = dimension
+        self.name = f"hashing:{dimension}"
+
+    def _embed_one(self, text):
+        vec = [0.0] * self.dimension
+        words = re.findall(r"\w+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            vec[h % self.dimension] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vec))
+        return [x / norm for x in vec] if norm else vec
+
+    def embed_documents(self, texts):
+        return [self._embed_one(t) for t in texts]
+
+
+PROVIDERS = {
+    "gemini": GeminiEmbeddingProvider,
+    "onnx": OnnxMiniLMEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+}
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Process-wide provider selected by EMBEDDING_PROVIDER (gemini | onnx | hashing)."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if EMBEDDING_PROVIDER not in PROVIDERS:
+                raise ValueError(f"Unknown EMBEDDING_PROVIDER {EMBEDDING_PROVIDER!r}, expected one of {list(PROVIDERS)}")
+            _provider = PROVIDERS[EMBEDDING_PROVIDER]()
+        return _provider
+
+
+def check_collection_provider(collection, provider: EmbeddingProvider):
+    """Refuse to query a collection with vectors from a different provider or dimension."""
+    meta = collection.metadata or {}
+    built_with = meta.get("embedding_provider")
+    if built_with is not None and built_with != provider.name:
+        raise ProviderMismatchError(
+            f"Index was built with {built_with} embeddings but the server uses {provider.name}; rebuild the index"
+        )
@@ -1,88 +1,195 @@
-import chromadb, os
-import google.generativeai as genai
-from typing import List
+import chromadb, os, hashlib, threading
+from typing import Dict, List, Optional
 from concurrent.futures import ThreadPoolExecutor
+from backend.utils.embedding_cache import get_embedding_cache, cache_key
+from backend.utils.embedding_providers import get_embedding_provider
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-EMBEDDING_MODEL = "models/text-embedding-004"
 
 # ----------------------------------------------------------
 # FAST BATCH EMBEDDING WITH PARALLELIZATION
 # ----------------------------------------------------------
-def embed_texts(texts: List[str], batch_size=12, max_workers=10):
-    embeddings = []
-
-    def embed_batch(batch):
-        try:
-            resp = genai.embed_content(
-                model=EMBEDDING_MODEL,
-                content=batch,
-                task_type="retrieval_document"
-            )
-            # gemini returns a list of embedding dicts
-            return resp["embedding"]
-        except Exception as e:
-            print("Embedding failed:", e)
-            return [[0]*768 for _ in batch]
-
-    # Create batches
-    batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+class EmbeddingError(Exception):
+    pass
+
+
+def embed_texts(texts: List[str], batch_size=None, max_workers=None, task_type="retrieval_document", on_progress=None):
+    """
+    Embed texts through the configured provider, skipping cached ones.
+    Workers pull batches from a shared cursor so the batch size can adapt
+    while indexing; any batch that still fails after retries raises
+    EmbeddingError instead of leaving placeholder vectors in the index.
+    `on_progress(done, total)` is called from the worker threads as
+    uncached texts are embedded.
+    """
+    # Only texts that are not in the content-addressed cache go to the provider
+    provider = get_embedding_provider()
+    max_workers = max_workers or provider.max_workers
+    embed = provider.embed_queries if task_type == "retrieval_query" else provider.embed_documents
+
+    cache = get_embedding_cache()
+    keys = [cache_key(provider.name, task_type, t) for t in texts]
+    cached = cache.get_many(keys) if cache is not None else {}
+
+    missing = {}
+    for k, t in zip(keys, texts):
+        if k not in cached and k not in missing:
+            missing[k] = t
+    missing_keys = list(missing.keys())
+    missing_texts = list(missing.values())
+
+    lock = threading.Lock()
+    cursor = [0]
+    done = [0]
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                if errors or cursor[0] >= len(missing_texts):
+                    return
+                start = cursor[0]
+                size = batch_size or provider.next_batch_size()
+                cursor[0] = start + size
+            batch = missing_texts[start:start+size]
+            # anything failing here (the provider, a locked cache, the progress callback)
+            # must surface as EmbeddingError rather than silently ending this worker
+            try:
+                vectors = embed(batch)
+                if len(vectors) != len(batch):
+                    raise EmbeddingError(f"expected {len(batch)} embeddings, got {len(vectors)}")
+                fresh = dict(zip(missing_keys[start:start+size], vectors))
+                with lock:
+                    cached.update(fresh)
+                    done[0] += len(batch)
+                    progress = done[0]
+                # persisted per batch, so a failed build keeps the work already paid for
+                if cache is not None:
+                    cache.put_many(fresh)
+                if on_progress:
+                    on_progress(progress, len(missing_texts))
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                return
 
     # Parallel embedding
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(embed_batch, batches)
+    n_workers = max(1, min(max_workers, len(missing_texts)))
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(worker) for _ in range(n_workers)]
+    for fut in futures:
+        if fut.exception() is not None:
+            errors.append(fut.exception())
 
-    for batch_emb in results:
-        embeddings.extend(batch_emb)
+    if errors:
+        raise EmbeddingError(f"Embedding failed: {errors[0]}") from errors[0]
 
-    return embeddings
+    return [cached[k] for k in keys]
 
 
 # ----------------------------------------------------------
-# BUILD FAST COLLECTION
+# STABLE SEGMENT IDS
 # ----------------------------------------------------------
-def build_collection_for_session(session_id: str, segments: List[dict]):
-    client = chromadb.Client()
-    col_name = f"session_{session_id}"
+def segment_id(segment: dict) -> str:
+    # derived from the source, the ingestion and the chunk position, never from list order;
+    # ingest_id keeps two different ingestions under one source name (e.g. "inline") apart
+    base = f"{segment.get('source_type', 'unknown')}:{segment.get('source_id', '')}"
+    if segment.get("ingest_id"):
+        base = f"{base}:{segment['ingest_id']}"
+    return f"{base}:{segment.get('chunk_index', 0)}"
 
-    # reset collection
-    try:
-        client.delete_collection(col_name)
-    except:
-        pass
 
-    collection = client.create_collection(name=col_name)
+def ingest_id(content_hash: str) -> str:
+    """Short id of one ingestion, from the hash of what was ingested."""
+    return content_hash[:16]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
 
-    # Pre-filter segments and align metadata in a single pass
-    texts, metadatas = [], []
+def index_fingerprint(indexed: Dict[str, str]) -> str:
+    """Content fingerprint of a collection, computed from its watermark."""
+    h = hashlib.sha256(get_embedding_provider().name.encode("utf-8"))
+    for sid in sorted(indexed):
+        h.update(f"\x00{sid}\x00{indexed[sid]}".encode("utf-8"))
+    return h.hexdigest()
+
+
+# ----------------------------------------------------------
+# BUILD / UPDATE COLLECTION INCREMENTALLY
+# ----------------------------------------------------------
+def build_collection_for_session(session_id: str, segments: List[dict], indexed: Optional[Dict[str, str]] = None, client=None,
+                                 on_progress=None):
+    """
+    Upsert only the segments that are not yet in the session's collection.
+    `indexed` is the session watermark ({segment_id: text_hash}) and is
+    updated in place as batches land; returns (client, collection, upserted).
+    `on_progress` is passed through to embed_texts.
+    """
+    client = client or chromadb.Client()
+    col_name = f"session_{session_id}"
+    if indexed is None:
+        indexed = {}
+
+    provider = get_embedding_provider()
+    col_meta = {"embedding_provider": provider.name, "dimension": provider.dimension}
+    collection = client.get_or_create_collection(name=col_name, metadata=col_meta)
+
+    # vectors from another provider cannot be mixed in, and no watermark
+    # means nothing is trusted: either way start from an empty collection
+    stale = (collection.metadata or {}).get("embedding_provider") != provider.name
+    if stale or (not indexed and collection.count() > 0):
+        indexed.clear()
+        client.delete_collection(col_name)
+        collection = client.create_collection(name=col_name, metadata=col_meta)
+
+    # Collect the delta; a later segment with the same id wins
+    pending = {}
     for s in segments:
         t = s.get("text")
-        if t:
-            texts.append(t)
-            md = {k: s[k] for k in ("source_type", "source_id", "start", "end", "page", "chunk_index") if k in s}
-            metadatas.append(md)
-
-    if not texts:
-        return client, collection
+        if not t:
+            continue
+        sid = segment_id(s)
+        h = text_hash(t)
+        if indexed.get(sid) == h:
+            pending.pop(sid, None)
+            continue
+        md = {k: s[k] for k in ("source_type", "source_id", "start", "end", "page", "chunk_index") if k in s}
+        pending[sid] = (t, md, h)
+
+    if not pending:
+        return client, collection, 0
+
+    ids = list(pending.keys())
+    texts = [pending[i][0] for i in ids]
+    metadatas = [pending[i][1] for i in ids]
 
     # Parallel embedding
-    embeddings = embed_texts(texts)
-
-    # aligned ids
-    ids = [str(i) for i in range(len(texts))]
+    embeddings = embed_texts(texts, on_progress=on_progress)
 
     BATCH_ADD_SIZE = 1000  # safe batch size for Chroma
 
-    for i in range(0, len(texts), BATCH_ADD_SIZE):
+    for i in range(0, len(ids), BATCH_ADD_SIZE):
         batch_ids = ids[i:i+BATCH_ADD_SIZE]
-        batch_texts = texts[i:i+BATCH_ADD_SIZE]
-        batch_embeddings = embeddings[i:i+BATCH_ADD_SIZE]
-        batch_metadatas = metadatas[i:i+BATCH_ADD_SIZE]
 
-        collection.add(
+        collection.upsert(
             ids=batch_ids,
-            documents=batch_texts,
-            embeddings=batch_embeddings,
-            metadatas=batch_metadatas,
+            documents=texts[i:i+BATCH_ADD_SIZE],
+            embeddings=embeddings[i:i+BATCH_ADD_SIZE],
+            metadatas=metadatas[i:i+BATCH_ADD_SIZE],
         )
-    return client, collection
+        for sid in batch_ids:
+            indexed[sid] = pending[sid][2]
+
+    return client, collection, len(ids)
+
+
+# ----------------------------------------------------------
+# DROP ONE SOURCE FROM THE COLLECTION
+# ----------------------------------------------------------
+def delete_source_from_collection(collection, source_id: str, source_type: Optional[str] = None):
+    where = {"source_id": source_id}
+    if source_type:
+        where = {"$and": [{"source_id": source_id}, {"source_type": source_type}]}
+    collection.delete(where=where)
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+GENERATION_MODEL = "gemini-2.0-flash"
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "6"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_CAP = float(os.getenv("GEMINI_BACKOFF_CAP", "30"))
+GEMINI_EMBED_MAX_CONCURRENCY = int(os.getenv("GEMINI_EMBED_MAX_CONCURRENCY", "32"))
+GEMINI_GENERATE_MAX_CONCURRENCY = int(os.getenv("GEMINI_GENERATE_MAX_CONCURRENCY", "128"))
+GEMINI_EMBED_MAX_BATCH = 100  # API limit per embed_content request
+
+
+class GeminiCallError(Exception):
+    """A Gemini call that still failed after all retries."""
+
+
+# ----------------------------------------------------------
+# ERROR CLASSIFICATION
+# ----------------------------------------------------------
+def _is_throttle(e: Exception) -> bool:
+    try:
+        from google.api_core import exceptions as gexc
+        if isinstance(e, (gexc.ResourceExhausted, gexc.TooManyRequests)):
+            return True
+    except ImportError:
+        pass
+    msg = str(e).lower()
+    return "429" in msg or "quota" in msg or "rate limit" in msg or "resource exhausted" in msg
+
+
+def _is_transient(e: Exception) -> bool:
+    try:
+        from google.api_core import exceptions as gexc
+        if isinstance(e, (gexc.ServiceUnavailable, gexc.InternalServerError, gexc.DeadlineExceeded, gexc.Aborted)):
+            return True
+    except ImportError:
+        pass
+    return isinstance(e, (ConnectionError, TimeoutError))
+
+
+def _backoff(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(GEMINI_BACKOFF_CAP, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+
+# ----------------------------------------------------------
+# AIMD CONCURRENCY AND BATCH-SIZE CONTROL
+# ----------------------------------------------------------
+class AdaptiveLimiter:
+    """
+    Concurrency window shared by threads and coroutines. It grows by about
+    one slot per window of successful calls and halves on a 429 / quota
+    error (at most once per cooldown, so a burst of 429s counts once).
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int, minimum: int = 1, cooldown: float = 1.0):
+        self.name = name
+        self.limit = float(min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def _wake(self):
+        # caller holds the lock; hand free slots to waiters in FIFO order
+        while self._waiters and self.in_flight < int(self.limit):
+            kind, waiter = self._waiters.popleft()
+            self.in_flight += 1
+            if kind == "thread":
+                waiter.set()
+            else:
+                loop, fut = waiter
+                loop.call_soon_threadsafe(self._hand_over, fut)
+
+    def _hand_over(self, fut):
+        if fut.done():  # the waiting coroutine was cancelled: give the slot back
+            self.release()
+        else:
+            fut.set_result(None)
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(("thread", event))
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            fut = loop.create_future()
+            entry = ("async", (loop, fut))
+            self._waiters.append(entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(entry)
+                except ValueError:
+                    pass  # already handed a slot
+            if fut.done() and not fut.cancelled():
+                # _hand_over ran before the cancellation landed: the slot is ours to give back
+                self.release()
+            # otherwise a pending _hand_over finds the future cancelled and returns the slot itself
+            raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self):
+        with self._lock:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._wake()
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+                logger.warning("Gemini %s throttled, concurrency limit now %d", self.name, int(self.limit))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "waiting": len(self._waiters)}
+
+
+class AdaptiveBatchSize:
+    """Embedding batch size: +1 per successful batch, halved on throttling."""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.value = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        with self._lock:
+            return self.value
+
+    def on_success(self):
+        with self._lock:
+            self.value = min(self.maximum, self.value + 1)
+
+    def on_throttle(self):
+        with self._lock:
+            self.value = max(self.minimum, self.value // 2)
+
+
+embed_limiter = AdaptiveLimiter("embed", initial=8, maximum=GEMINI_EMBED_MAX_CONCURRENCY)
+generate_limiter = AdaptiveLimiter("generate", initial=16, maximum=GEMINI_GENERATE_MAX_CONCURRENCY)
+embed_batch_size = AdaptiveBatchSize(initial=16, maximum=GEMINI_EMBED_MAX_BATCH)
+
+
+# ----------------------------------------------------------
+# RETRYING CALLS
+# ----------------------------------------------------------
+def call_with_retry(fn, limiter: AdaptiveLimiter, on_throttle=None, on_success=None):
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            throttled = _is_throttle(e)
+            if throttled:
+                limiter.on_throttle()
+                if on_throttle:
+                    on_throttle()
+            if not (throttled or _is_transient(e)) or attempt == GEMINI_MAX_RETRIES:
+                raise GeminiCallError(f"Gemini {limiter.name} call failed after {attempt + 1} attempt(s): {e}") from e
+        else:
+            limiter.on_success()
+            if on_success:
+                on_success()
+            return result
+        finally:
+            limiter.release()
+        time.sleep(_backoff(attempt))
+
+
+async def acall_with_retry(make_coro, limiter: AdaptiveLimiter, on_throttle=None, on_success=None):
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        await limiter.aacquire()
+        try:
+            result = await make_coro()
+        except Exception as e:
+            throttled = _is_throttle(e)
+            if throttled:
+                limiter.on_throttle()
+                if on_throttle:
+                    on_throttle()
+            if not (throttled or _is_transient(e)) or attempt == GEMINI_MAX_RETRIES:
+                raise GeminiCallError(f"Gemini {limiter.name} call failed after {attempt + 1} attempt(s): {e}") from e
+        else:
+            limiter.on_success()
+            if on_success:
+                on_success()
+            return result
+        finally:
+            limiter.release()
+        await asyncio.sleep(_backoff(attempt))
+
+
+# ----------------------------------------------------------
+# PUBLIC API USED BY EVERY GEMINI CALLER
+# ----------------------------------------------------------
+def embed(model: str, texts, task_type: str):
+    resp = call_with_retry(
+        lambda: genai.embed_content(model=model, content=texts, task_type=task_type),
+        embed_limiter, embed_batch_size.on_throttle, embed_batch_size.on_success,
+    )
+    return resp["embedding"]
+
+
+async def aembed(model: str, texts, task_type: str):
+    resp = await acall_with_retry(
+        lambda: genai.embed_content_async(model=model, content=texts, task_type=task_type),
+        embed_limiter, embed_batch_size.on_throttle, embed_batch_size.on_success,
+    )
+    return resp["embedding"]
+
+
+def generate(prompt: str, model: str = GENERATION_MODEL) -> str:
+    m = genai.GenerativeModel(model)
+    resp = call_with_retry(lambda: m.generate_content(prompt), generate_limiter)
+    return resp.text
+
+
+async def agenerate(prompt: str, model: str = GENERATION_MODEL) -> str:
+    m = genai.GenerativeModel(model)
+    resp = await acall_with_retry(lambda: m.generate_content_async(prompt), generate_limiter)
+    return resp.text
+
+
+def _chunk_text(chunk) -> str:
+    # `.text` raises ValueError on chunks without parts (safety blocks, empty finish chunks)
+    candidates = getattr(chunk, "candidates", None) or []
+    if not candidates or not candidates[0].content:
+        return ""
+    return "".join(getattr(part, "text", "") or "" for part in candidates[0].content.parts)
+
+
+async def astream(prompt: str, model: str = GENERATION_MODEL):
+    """
+    Stream text chunks. Opening the stream is retried like any other call;
+    once tokens have been sent to the client a failure is raised as is.
+    """
+    m = genai.GenerativeModel(model)
+    resp = await acall_with_retry(lambda: m.generate_content_async(prompt, stream=True), generate_limiter)
+    await generate_limiter.aacquire()
+    try:
+        async for chunk in resp:
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+    finally:
+        generate_limiter.release()
+
+
+def stats() -> dict:
+    return {
+        "embed": {**embed_limiter.snapshot(), "batch_size": embed_batch_size.current()},
+        "generate": generate_limiter.snapshot(),
+    }
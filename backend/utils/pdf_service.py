@@ -1,23 +1,111 @@
 from pypdf import PdfReader
 from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import threading
+import os
 
-def load_pdf_chunks(file_path, chunk_size=800):
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_PAGES_PER_TASK = 16
+
+logger = logging.getLogger(__name__)
+
+def _extract_page_range(file_path, start, stop):
+    # runs in a worker process: every worker opens its own reader
     reader = PdfReader(file_path)
-    chunks = []
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pdf_pool():
+    """
+    One process pool for every upload, created once. Workers are started by
+    forkserver (spawn where unavailable): forking the threaded server process
+    itself can deadlock the children.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+def shutdown_pdf_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def _discard_pool(pool):
+    # a worker died (OOM kill, crash in a native parser): the executor is
+    # unusable from now on, so the next get_pdf_pool() starts a fresh one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_page_texts(file_path, workers=None):
+    """
+    Yield (page_number, text) in page order.
+    Large documents are split into page ranges and extracted in the shared
+    process pool; results are consumed in submission order so output is
+    identical to the serial path. workers <= 1 extracts serially. If a
+    worker dies the pool is replaced for later uploads and this document
+    finishes serially from the first page not yet yielded.
+    """
+    reader = PdfReader(file_path)
+    n_pages = len(reader.pages)
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+
+    if workers <= 1 or n_pages < PDF_PARALLEL_MIN_PAGES:
+        for i, page in enumerate(reader.pages):
+            yield i + 1, page.extract_text() or ""
+        return
+
+    ranges = [(s, min(s + PDF_PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PDF_PAGES_PER_TASK)]
+    # concurrent uploads share the pool, so the process count stays at PDF_EXTRACT_WORKERS
+    pool = get_pdf_pool()
+    futures = []
+    next_page = 0
+    try:
+        futures = [pool.submit(_extract_page_range, str(file_path), s, e) for s, e in ranges]
+        for (start, stop), fut in zip(ranges, futures):
+            for offset, text in enumerate(fut.result()):
+                yield start + offset + 1, text
+            next_page = stop
+        return
+    except BrokenProcessPool:
+        logger.warning("PDF worker pool broke while extracting %s; finishing serially", file_path)
+        _discard_pool(pool)
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+    for i in range(next_page, n_pages):
+        yield i + 1, reader.pages[i].extract_text() or ""
+
+def iter_pdf_chunks(file_path, chunk_size=800, workers=None):
     chunk_index = 0
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
+    for page_no, text in iter_page_texts(file_path, workers=workers):
         # naive chunking by characters:
         pos = 0
         while pos < len(text):
             piece = text[pos: pos + chunk_size]
-            chunks.append({
+            yield {
                 "source_type": "pdf",
                 "source_id": file_path.name,
-                "page": i + 1,
+                "page": page_no,
                 "chunk_index": chunk_index,
                 "text": piece.strip()
-            })
+            }
             chunk_index += 1
             pos += chunk_size
-    return chunks
+
+def load_pdf_chunks(file_path, chunk_size=800, workers=None):
+    return list(iter_pdf_chunks(file_path, chunk_size=chunk_size, workers=workers))
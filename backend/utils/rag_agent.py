@@ -1,23 +1,14 @@
-import google.generativeai as genai
+import asyncio
 import os
+from backend.utils.concurrency import limiter
+from backend.utils import gemini_client
+from backend.utils.answer_cache import answer_cache
+from backend.utils.embedding_providers import get_embedding_provider, check_collection_provider
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-EMBEDDING_MODEL = "models/text-embedding-004"
 GENERATION_MODEL = "gemini-2.0-flash"
 
-def query_collection_and_answer(collection, query: str, n_results: int = 5):
-    # embed the query
-    q_emb_resp = genai.embed_content(
-        model=EMBEDDING_MODEL,
-        content=query,
-        task_type="retrieval_query"
-    )
-    q_emb = q_emb_resp["embedding"] if isinstance(q_emb_resp, dict) and "embedding" in q_emb_resp else q_emb_resp
-
-    res = collection.query(query_embeddings=[q_emb], n_results=n_results)
-    docs = res["documents"][0]
-    metadatas = res["metadatas"][0]
-
+def format_context(docs, metadatas) -> str:
     # Build a context that includes source metadata
     ctx_pieces = []
     for d, m in zip(docs, metadatas):
@@ -34,9 +25,10 @@ def query_collection_and_answer(collection, query: str, n_results: int = 5):
         meta_str += "]"
         ctx_pieces.append(f"{meta_str} {d}")
 
-    context = "\n\n".join(ctx_pieces)
+    return "\n\n".join(ctx_pieces)
 
-    prompt = f"""
+def build_answer_prompt(context: str, query: str) -> str:
+    return f"""
 You are an AI learning companion. Your job is to explain things in a warm, conversational, and student-friendly way—while staying strictly grounded in the provided context.
 
 Your goals:
@@ -71,13 +63,183 @@ Student question:
 Answer:
 """
 
+def query_collection_and_answer(collection, query: str, n_results: int = 5):
+    # embed the query with the same provider the index was built with
+    provider = get_embedding_provider()
+    check_collection_provider(collection, provider)
+    q_emb = provider.embed_queries([query])[0]
+
+    res = collection.query(query_embeddings=[q_emb], n_results=n_results)
+    docs = res["documents"][0]
+    metadatas = res["metadatas"][0]
+
+    prompt = build_answer_prompt(format_context(docs, metadatas), query)
 
+    answer_text = gemini_client.generate(prompt, GENERATION_MODEL)
+    return {
+        "answer": answer_text,
+        "retrieved": [{"doc": d, "metadata": m} for d, m in zip(docs, metadatas)]
+    }
+
+
+async def aembed_query(query: str):
+    async with limiter("embedding"):
+        return (await get_embedding_provider().aembed_queries([query]))[0]
 
-    model = genai.GenerativeModel(GENERATION_MODEL)
-    resp = model.generate_content(prompt)
-    answer_text = resp.text if hasattr(resp, "text") else str(resp)
+
+async def aretrieve(collection, query: str, n_results: int = 5, q_emb=None):
+    check_collection_provider(collection, get_embedding_provider())
+    if q_emb is None:
+        q_emb = await aembed_query(query)
+
+    # Chroma has no async client for the in-process store
+    res = await asyncio.to_thread(collection.query, query_embeddings=[q_emb], n_results=n_results)
+    return res["documents"][0], res["metadatas"][0]
+
+
+async def _aanswer_from_context(query, docs, metadatas):
+    prompt = build_answer_prompt(format_context(docs, metadatas), query)
+
+    answer_text = await gemini_client.agenerate(prompt, GENERATION_MODEL)
     return {
         "answer": answer_text,
         "retrieved": [{"doc": d, "metadata": m} for d, m in zip(docs, metadatas)]
     }
 
+
+async def _alookup_cache(query, fingerprint, semantic):
+    """Returns (cached response or None, how it was found, query embedding if computed)."""
+    if fingerprint is None:
+        return None, None, None
+    hit = answer_cache.get_exact(fingerprint, query)
+    if hit is not None:
+        return hit, "exact", None
+    q_emb = await aembed_query(query)
+    if semantic:
+        # the similarity scan is CPU-bound; keep it off the event loop
+        hit = await asyncio.to_thread(answer_cache.get_semantic, fingerprint, q_emb)
+        if hit is not None:
+            return hit, "semantic", q_emb
+    answer_cache.record_miss()
+    return None, "miss", q_emb
+
+
+async def aquery_collection_and_answer(collection, query: str, n_results: int = 5, fingerprint=None, semantic=False):
+    """
+    `fingerprint` identifies the collection contents and enables the answer
+    cache; `semantic` also accepts near-duplicate questions.
+    """
+    hit, cache_status, q_emb = await _alookup_cache(query, fingerprint, semantic)
+    if hit is not None:
+        return {**hit, "cache": cache_status}
+
+    docs, metadatas = await aretrieve(collection, query, n_results, q_emb=q_emb)
+    out = await _aanswer_from_context(query, docs, metadatas)
+    if fingerprint is not None:
+        answer_cache.put(fingerprint, query, out, embedding=q_emb)
+        out = {**out, "cache": cache_status}
+    return out
+
+
+async def astream_query_collection_and_answer(collection, query: str, n_results: int = 5, fingerprint=None, semantic=False):
+    """
+    Yields ("sources", retrieved) as soon as retrieval finishes, then
+    ("token", text) for every chunk the model emits. A cached answer is
+    sent as a single token.
+    """
+    hit, cache_status, q_emb = await _alookup_cache(query, fingerprint, semantic)
+    if hit is not None:
+        yield "sources", hit["retrieved"]
+        yield "token", hit["answer"]
+        return
+
+    docs, metadatas = await aretrieve(collection, query, n_results, q_emb=q_emb)
+    retrieved = [{"doc": d, "metadata": m} for d, m in zip(docs, metadatas)]
+    yield "sources", retrieved
+
+    prompt = build_answer_prompt(format_context(docs, metadatas), query)
+
+    pieces = []
+    async for text in gemini_client.astream(prompt, GENERATION_MODEL):
+        pieces.append(text)
+        yield "token", text
+
+    if fingerprint is not None:
+        answer_cache.put(fingerprint, query, {"answer": "".join(pieces), "retrieved": retrieved}, embedding=q_emb)
+
+
+async def aembed_queries(queries):
+    # one call per provider.max_batch questions (100 for Gemini)
+    provider = get_embedding_provider()
+    embeddings = []
+    for i in range(0, len(queries), provider.max_batch):
+        async with limiter("embedding"):
+            embeddings.extend(await provider.aembed_queries(queries[i:i+provider.max_batch]))
+    return embeddings
+
+
+async def aquery_collection_batch(collection, queries, n_results: int = 5, fingerprint=None, semantic=False):
+    """
+    Answer many questions with one batched query embedding and one
+    multi-query Chroma lookup; answers are generated concurrently.
+    Returns one entry per question, in input order, with "error" set on failure.
+    """
+    check_collection_provider(collection, get_embedding_provider())
+    results = [None] * len(queries)
+    pending = []
+    for i, q in enumerate(queries):
+        hit = answer_cache.get_exact(fingerprint, q) if fingerprint is not None else None
+        if hit is not None:
+            results[i] = {"question": q, **hit, "cache": "exact"}
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    try:
+        embeddings = await aembed_queries([queries[i] for i in pending])
+    except Exception as e:
+        for i in pending:
+            results[i] = {"question": queries[i], "error": str(e)}
+        return results
+    q_embs = dict(zip(pending, embeddings))
+
+    semantic_hits = [None] * len(pending)
+    if fingerprint is not None and semantic:
+        # one matrix product for every question, off the event loop
+        semantic_hits = await asyncio.to_thread(answer_cache.get_semantic_many, fingerprint, embeddings)
+
+    to_answer = []
+    for i, hit in zip(pending, semantic_hits):
+        if hit is not None:
+            results[i] = {"question": queries[i], **hit, "cache": "semantic"}
+            continue
+        if fingerprint is not None:
+            answer_cache.record_miss()
+        to_answer.append(i)
+    if not to_answer:
+        return results
+
+    try:
+        res = await asyncio.to_thread(
+            collection.query, query_embeddings=[q_embs[i] for i in to_answer], n_results=n_results
+        )
+    except Exception as e:
+        for i in to_answer:
+            results[i] = {"question": queries[i], "error": str(e)}
+        return results
+
+    answers = await asyncio.gather(*(
+        _aanswer_from_context(queries[i], res["documents"][k], res["metadatas"][k])
+        for k, i in enumerate(to_answer)
+    ), return_exceptions=True)
+
+    for i, out in zip(to_answer, answers):
+        if isinstance(out, Exception):
+            results[i] = {"question": queries[i], "error": str(out)}
+            continue
+        if fingerprint is not None:
+            answer_cache.put(fingerprint, queries[i], out, embedding=q_embs[i])
+            out = {**out, "cache": "miss"}
+        results[i] = {"question": queries[i], **out}
+    return results
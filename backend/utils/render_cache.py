@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+MINDMAP_CACHE_DIR = Path(os.getenv("MINDMAP_CACHE_DIR", "/tmp/rag_cache/mindmaps"))
+MINDMAP_CACHE_MEMORY_ENTRIES = int(os.getenv("MINDMAP_CACHE_MEMORY_ENTRIES", "256"))
+MINDMAP_CACHE_MAX_FILES = int(os.getenv("MINDMAP_CACHE_MAX_FILES", "10000"))
+RENDER_CACHE_VERSION = 1  # bump when renderer output changes, so old SVGs are not served
+
+
+def render_key(data: dict, **options) -> str:
+    """sha256 of the canonical JSON of the topic tree plus the renderer options."""
+    canonical = json.dumps(
+        {"v": RENDER_CACHE_VERSION, "data": data, "options": options},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered SVGs by content key: an in-memory LRU in front of one file per
+    key on disk. Identical trees render once across sessions and restarts;
+    the oldest files are removed once the directory passes max_files.
+    """
+
+    def __init__(self, directory: Path = MINDMAP_CACHE_DIR, memory_entries: int = MINDMAP_CACHE_MEMORY_ENTRIES,
+                 max_files: int = MINDMAP_CACHE_MAX_FILES):
+        self.directory = Path(directory)
+        self.memory_entries = memory_entries
+        self.max_files = max_files
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._file_count = None  # files on disk, tracked after the first scan
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.svg"
+
+    def _remember(self, key: str, svg: str):
+        # caller holds the lock
+        self._memory[key] = svg
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Memory only, cheap enough for the event loop."""
+        with self._lock:
+            svg = self._memory.get(key)
+            if svg is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+            return svg
+
+    def load_or_render(self, key: str, render, *args) -> str:
+        """Disk lookup, else `render(*args)` and store; blocking, run it in a worker thread."""
+        path = self._path(key)
+        try:
+            svg = path.read_text(encoding="utf-8")
+            os.utime(path)  # mtime doubles as last use for eviction
+            counter = "disk_hits"
+        except OSError:
+            svg = render(*args)
+            counter = "misses"
+            try:
+                self._write(path, svg)
+            except OSError:
+                pass
+        with self._lock:
+            self.counters[counter] += 1
+            self._remember(key, svg)
+        return svg
+
+    def _write(self, path: Path, svg: str):
+        existed = path.exists()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(svg, encoding="utf-8")
+        os.replace(tmp, path)
+        with self._disk_lock:
+            # the directory is scanned once at first use and then only when it overflows
+            if self._file_count is None:
+                self._file_count = sum(1 for _ in self.directory.glob("*/*.svg"))
+            elif not existed:
+                self._file_count += 1
+            if self._file_count > self.max_files:
+                self._evict()
+
+    def _evict(self):
+        # caller holds the disk lock; trim to 90% so the next scan is max_files / 10 writes away
+        files = list(self.directory.glob("*/*.svg"))
+        target = int(self.max_files * 0.9)
+        def mtime(p):
+            try:
+                return p.stat().st_mtime
+            except OSError:
+                return 0.0
+        removed = 0
+        for p in sorted(files, key=mtime)[:max(0, len(files) - target)]:
+            try:
+                p.unlink()
+                removed += 1
+            except OSError:
+                pass
+        self._file_count = len(files) - removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "memory_entries": len(self._memory)}
+
+
+mindmap_cache = RenderCache()
@@ -1,8 +1,26 @@
-import json, re
+import argparse, hashlib, json, re, logging, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 
-def merge_fragments_into_sentences(fragments, max_gap=1.0):
-    sentences = []
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEYWORDS = ("next", "question", "let's move", "our guest", "first off", "so let's", "now, before we", "says", "so, now", "first question", "next question", "last question", "final question")
+
+SENTENCE_END = re.compile(r"[.?!]['\")\]]*$")
+SAYS_PATTERN = r"\b[a-z]+(?: [a-z]+)? says\b"
+
+@lru_cache(maxsize=32)
+def compile_boundary_matcher(keywords):
+    """
+    One regex for every boundary cue: the keyword alternation (longest first)
+    plus the "<name> says" pattern. Compiled once per keyword tuple.
+    """
+    kws = sorted({kw.lower() for kw in keywords}, key=len, reverse=True)
+    alternation = "|".join(re.escape(kw) for kw in kws)
+    return re.compile(f"(?P<kw>{alternation})|(?P<says>{SAYS_PATTERN})" if kws else f"(?P<says>{SAYS_PATTERN})")
+
+def iter_sentences(fragments, max_gap=1.0):
     current = {"start": None, "end": None, "text": ""}
     for frag in fragments:
         text = frag["text"].strip()
@@ -13,80 +31,197 @@ def merge_fragments_into_sentences(fragments, max_gap=1.0):
         gap = start - current["end"] if current["end"] is not None else 0
         current["text"] += (" " if current["text"] else "") + text
         current["end"] = end
-        if re.search(r"[.?!]['\")\]]*$", text) or gap > max_gap:
-            sentences.append(current)
+        if SENTENCE_END.search(text) or gap > max_gap:
+            yield current
             current = {"start": None, "end": None, "text": ""}
     if current["text"]:
-        sentences.append(current)
-    return sentences
+        yield current
 
-def segment_by_gap_and_keywords(sentences, time_gap=2.5, keywords=None):
-    if keywords is None:
-        keywords = ["next", "question", "let's move", "our guest", "first off", "so let's", "now, before we", "says", "so, now", "first question", "next question", "last question", "final question"]
+def merge_fragments_into_sentences(fragments, max_gap=1.0):
+    return list(iter_sentences(fragments, max_gap=max_gap))
+
+def iter_segments_by_gap_and_keywords(sentences, time_gap=2.5, keywords=None, max_chars=None):
+    """
+    Streaming segmentation: consumes any iterable of sentences and yields
+    segments as soon as a boundary is seen, holding only the open segment.
+    """
+    matcher = compile_boundary_matcher(tuple(DEFAULT_KEYWORDS if keywords is None else keywords))
+    debug = logger.isEnabledFor(logging.DEBUG)
 
-    segments = []
-    current_segment = []
+    current = None
     prev_end = None
 
     for sent in sentences:
         gap = sent["start"] - prev_end if prev_end is not None else 0
-        keyword_hit = any(re.search(re.escape(kw), sent["text"].lower()) for kw in keywords)
-        says_pattern_hit = bool(re.search(r"\b[a-z]+(?: [a-z]+)? says\b", sent["text"].lower()))
-
-        if keyword_hit:
-            print(f"Keyword hit on: {sent['text']}")
-        if gap > time_gap or keyword_hit or says_pattern_hit:
-            if current_segment:
-                segment = {
-                    "start": current_segment[0]["start"],
-                    "end": current_segment[-1]["end"],
-                    "text": " ".join(s["text"] for s in current_segment)
-                }
-                segments.append(segment)
-            current_segment = [sent]
+        hit = matcher.search(sent["text"].lower())
+
+        if debug and hit is not None and hit.group("kw") is not None:
+            logger.debug("Keyword hit on: %s", sent["text"])
+
+        too_long = max_chars is not None and current is not None and len(current["text"]) + 1 + len(sent["text"]) > max_chars
+        if gap > time_gap or hit is not None or too_long:
+            if current is not None:
+                yield current
+            current = None
+
+        if current is None:
+            current = {"start": sent["start"], "end": sent["end"], "text": sent["text"]}
         else:
-            current_segment.append(sent)
+            current["end"] = sent["end"]
+            current["text"] += " " + sent["text"]
 
         prev_end = sent["end"]
 
     # Add the final segment
-    if current_segment:
-        segment = {
-            "start": current_segment[0]["start"],
-            "end": current_segment[-1]["end"],
-            "text": " ".join(s["text"] for s in current_segment)
-        }
-        segments.append(segment)
-
-    return segments
+    if current is not None:
+        yield current
 
+def segment_by_gap_and_keywords(sentences, time_gap=2.5, keywords=None, max_chars=None):
+    return list(iter_segments_by_gap_and_keywords(sentences, time_gap=time_gap, keywords=keywords, max_chars=max_chars))
 
-if __name__ == "__main__":
-    input_dir = Path("resources") /"transcripts" / "json"
 
-    base_dir = Path("resources") / "transcripts" / "processed"
+def window_sentences(sentences, max_chars=1000, time_gap=2.5):
+    """Pack consecutive sentences into windows of at most ~max_chars, breaking on long pauses."""
+    windows = []
+    current = None
+    for sent in sentences:
+        if current is not None:
+            gap = sent["start"] - current["end"]
+            if gap > time_gap or len(current["text"]) + 1 + len(sent["text"]) > max_chars:
+                windows.append(current)
+                current = None
+        if current is None:
+            current = {"start": sent["start"], "end": sent["end"], "text": sent["text"]}
+        else:
+            current["text"] += " " + sent["text"]
+            current["end"] = sent["end"]
+    if current is not None:
+        windows.append(current)
+    return windows
+
+SEGMENT_MODES = ("raw", "sentences", "window", "topics")
+
+def build_transcript_windows(fragments, mode="window", max_chars=1000, max_gap=1.0, time_gap=2.5, keywords=None):
+    """
+    Turn raw {text, start, duration} fragments into indexable {start, end, text} segments.
+      raw       - one segment per fragment (previous behaviour)
+      sentences - fragments merged into sentences
+      window    - sentences packed up to max_chars
+      topics    - sentences grouped by pauses and topic-shift keywords, capped at max_chars
+    """
+    if mode == "raw":
+        return [{"start": f["start"], "end": f["start"] + f["duration"], "text": f["text"]} for f in fragments]
+
+    sentences = iter_sentences(fragments, max_gap=max_gap)
+    if mode == "sentences":
+        return list(sentences)
+    if mode == "window":
+        return window_sentences(sentences, max_chars=max_chars, time_gap=time_gap)
+    if mode == "topics":
+        return segment_by_gap_and_keywords(sentences, time_gap=time_gap, keywords=keywords, max_chars=max_chars)
+    raise ValueError(f"Unknown segment mode: {mode}")
+
+
+# ----------------------------------------------------------
+# OFFLINE BATCH PREPROCESSING
+# ----------------------------------------------------------
+try:
+    import orjson
+
+    def _loads(data: bytes):
+        return orjson.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _loads(data: bytes):
+        return json.loads(data)
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+def preprocess_file(input_path, sentence_dir, segment_dir, known_hash=None):
+    """
+    Worker for the batch tool. Returns (name, input_hash, n_sentences, n_segments);
+    the counts are None when the input hash matches `known_hash` and outputs exist.
+    """
+    input_path = Path(input_path)
+    raw = input_path.read_bytes()
+    input_hash = hashlib.sha256(raw).hexdigest()
+
+    base_name = input_path.stem  # filename without .json
+    sentence_path = Path(sentence_dir) / f"{base_name}.json"
+    segment_path = Path(segment_dir) / f"{base_name}.json"
+
+    if input_hash == known_hash and sentence_path.exists() and segment_path.exists():
+        return input_path.name, input_hash, None, None
+
+    fragments = _loads(raw)
+    sentences = merge_fragments_into_sentences(fragments)
+    segments = segment_by_gap_and_keywords(sentences)
+
+    sentence_path.write_bytes(_dumps(sentences))
+    segment_path.write_bytes(_dumps(segments))
+    return input_path.name, input_hash, len(sentences), len(segments)
+
+def preprocess_corpus(input_dir, output_dir, workers=None, limit=None, force=False):
+    input_dir, base_dir = Path(input_dir), Path(output_dir)
     sentence_dir = base_dir / "sentences"
     segment_dir = base_dir / "segments"
-
-    base_dir.mkdir(parents=True, exist_ok=True)
     sentence_dir.mkdir(parents=True, exist_ok=True)
     segment_dir.mkdir(parents=True, exist_ok=True)
-    input_paths = list(input_dir.glob("*.json"))[:15]
-    for input_path in input_paths:
-        with open(input_path, "r", encoding="utf-8") as f:
-            fragments = json.load(f)
 
-        sentences = merge_fragments_into_sentences(fragments)
-        segments = segment_by_gap_and_keywords(sentences)
+    # input hashes from previous runs; unchanged files are skipped
+    manifest_path = base_dir / "manifest.json"
+    manifest = _loads(manifest_path.read_bytes()) if manifest_path.exists() and not force else {}
+
+    input_paths = sorted(input_dir.glob("*.json"))
+    if limit:
+        input_paths = input_paths[:limit]
 
-        base_name = input_path.stem  # filename without .json
-        sentence_path = sentence_dir / f"{base_name}.json"
-        segment_path = segment_dir / f"{base_name}.json"
+    stats = {"files": 0, "skipped": 0, "failed": 0, "sentences": 0, "segments": 0}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(preprocess_file, str(p), str(sentence_dir), str(segment_dir), manifest.get(p.name)): p
+            for p in input_paths
+        }
+        for fut in as_completed(futures):
+            try:
+                name, input_hash, n_sent, n_seg = fut.result()
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error("Failed to preprocess %s: %s", futures[fut], e)
+                continue
+            manifest[name] = input_hash
+            if n_sent is None:
+                stats["skipped"] += 1
+                continue
+            stats["files"] += 1
+            stats["sentences"] += n_sent
+            stats["segments"] += n_seg
+            logger.info("Saved %d sentences and %d segments for %s", n_sent, n_seg, name)
+
+    manifest_path.write_bytes(_dumps(manifest))
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["files_per_sec"] = round(stats["files"] / elapsed, 2) if elapsed else 0.0
+    stats["sentences_per_sec"] = round(stats["sentences"] / elapsed, 2) if elapsed else 0.0
+    return stats
 
-        with open(sentence_path, "w", encoding="utf-8") as f:
-            json.dump(sentences, f, indent=2, ensure_ascii=False)
-        print(f"Saved {len(sentences)} merged sentences to {sentence_path}")
 
-        with open(segment_path, "w", encoding="utf-8") as f:
-            json.dump(segments, f, indent=2, ensure_ascii=False)
-        print(f"Saved {len(segments)} segments to {segment_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge transcript fragments into sentences and segments.")
+    parser.add_argument("--input-dir", default=str(Path("resources") / "transcripts" / "json"))
+    parser.add_argument("--output-dir", default=str(Path("resources") / "transcripts" / "processed"))
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N files")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and reprocess everything")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    stats = preprocess_corpus(args.input_dir, args.output_dir, workers=args.workers, limit=args.limit, force=args.force)
+    print(
+        f"Processed {stats['files']} files ({stats['skipped']} unchanged, {stats['failed']} failed) "
+        f"in {stats['seconds']}s: {stats['files_per_sec']} files/sec, {stats['sentences_per_sec']} sentences/sec"
+    )
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+
+from fastapi.responses import JSONResponse
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+async def save_upload(upload, dest_dir, max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Stream an UploadFile to `dest_dir` in fixed-size chunks.
+    Returns (path, sha256 hex digest, size in bytes); the hash is computed
+    while streaming so nothing is read twice.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+
+    # never trust the client filename as a path
+    path = Path(dest_dir) / Path(upload.filename or "upload").name
+    digest = hashlib.sha256()
+    size = 0
+    # disk writes go to a worker thread so a slow volume never stalls the event loop
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+    return path, digest.hexdigest(), size
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware answering 413 once a request body to one of `paths`
+    passes max_body bytes. A declared Content-Length is rejected before
+    anything is read; chunked or understated bodies are counted as they
+    arrive, so the multipart parser stops spooling at the limit.
+    """
+
+    def __init__(self, app, paths, max_body: int):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_body = max_body
+
+    def _reject(self):
+        return JSONResponse({"error": f"Upload exceeds {self.max_body} bytes"}, status_code=413)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_body:
+            return await self._reject()(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    exceeded = True
+                    raise UploadTooLargeError(f"Upload exceeds {self.max_body} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # whatever the app made of the aborted body parse, the client gets a 413
+                if message["type"] == "http.response.start" and not started:
+                    started = True
+                    await self._reject()(scope, receive, send)
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded or started:
+                raise
+            await self._reject()(scope, receive, send)
@@ -2,10 +2,23 @@ from typing import Dict, List
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import JSONFormatter
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from backend.utils.concurrency import run_blocking
+from pathlib import Path
 import requests
+import asyncio
+import threading
+import hashlib
+import json
+import time
 import os
 
 API_KEY = os.getenv("YOUTUBE_API_KEY")
+TRANSCRIPT_CACHE_DIR = Path(os.getenv("TRANSCRIPT_CACHE_DIR", "/tmp/rag_cache/transcripts"))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSCRIPT_CACHE_MAX_FILES = int(os.getenv("TRANSCRIPT_CACHE_MAX_FILES", "20000"))
+DEFAULT_LANGUAGES = ("en", "hi")
+BULK_FETCH_WORKERS = int(os.getenv("BULK_FETCH_WORKERS", "8"))
 
 def extract_video_id(url: str) -> str:
     parsed = urlparse(url)
@@ -15,14 +28,79 @@ def extract_video_id(url: str) -> str:
             return qs["v"][0]
     if parsed.netloc and "youtu.be" in parsed.netloc:
         return parsed.path.lstrip("/")
-    if "/embed/" in parsed.path:
-        return parsed.path.split("/embed/")[1]
+    for prefix in ("/embed/", "/shorts/", "/live/"):
+        if prefix in parsed.path:
+            return parsed.path.split(prefix)[1].split("/")[0]
     raise ValueError("Could not extract video id from url")
 
-def download_transcript(video_id: str) -> Dict:
+def is_collection_url(url: str) -> bool:
+    """Playlist or channel pages, which expand to many videos."""
+    parsed = urlparse(url)
+    path = parsed.path
+    if path.startswith("/playlist"):
+        return True
+    if path.startswith(("/@", "/channel/", "/c/", "/user/")):
+        return True
+    # a watch url with list= is a playlist only when no single video is pinned
+    qs = parse_qs(parsed.query)
+    return "list" in qs and "v" not in qs
+
+def normalize_collection_url(url: str) -> str:
+    """Point a bare channel url at its /videos tab; a bare channel lists its tabs, not its videos."""
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split("/") if p]
+    if not parts:
+        return url
+    if parts[0].startswith("@"):
+        depth = 1
+    elif parts[0] in ("channel", "c", "user") and len(parts) > 1:
+        depth = 2
+    else:
+        return url
+    if len(parts) == depth:
+        return parsed._replace(path="/" + "/".join(parts + ["videos"])).geturl()
+    return url
+
+def list_collection_video_ids(url: str) -> List[str]:
+    # flat extraction only reads the listing, it never touches the videos themselves
+    from yt_dlp import YoutubeDL
+    with YoutubeDL({"extract_flat": True, "quiet": True, "skip_download": True}) as ydl:
+        info = ydl.extract_info(normalize_collection_url(url), download=False)
+
+    ids = []
+    def walk(entry):
+        for child in entry.get("entries") or []:
+            if child is None:
+                continue
+            if child.get("_type") == "playlist" or child.get("entries"):
+                walk(child)  # channels nest their tabs as playlists
+            elif child.get("ie_key") == "Youtube" and child.get("id"):
+                ids.append(child["id"])  # only single videos; tab and channel links are skipped
+    walk(info)
+    return ids
+
+def expand_video_ids(urls: List[str]):
+    """
+    Resolve single-video, playlist and channel urls into unique video ids, in
+    order. A url that cannot be resolved is reported in `failed` as
+    {url, error} instead of failing the others; returns (video_ids, failed).
+    """
+    ids = []
+    failed = []
+    for url in urls:
+        try:
+            if is_collection_url(url):
+                ids.extend(list_collection_video_ids(url))
+            else:
+                ids.append(extract_video_id(url))
+        except Exception as e:
+            failed.append({"url": url, "error": str(e)})
+    return list(dict.fromkeys(ids)), failed
+
+def fetch_transcript(video_id: str, languages=DEFAULT_LANGUAGES) -> Dict:
     ytt = YouTubeTranscriptApi()
     transcript_list = ytt.list(video_id)
-    transcript = transcript_list.find_transcript(['en','hi']).fetch()
+    transcript = transcript_list.find_transcript(list(languages)).fetch()
     formatter = JSONFormatter()
     timestamped = formatter.format_transcript(transcript)
 
@@ -45,7 +123,158 @@ def download_transcript(video_id: str) -> Dict:
     return {
         "source_type": "youtube",
         "source_id": video_id,
-        "raw_fragments": transcript,           # list of {text, start, duration}
+        "raw_fragments": transcript.to_raw_data(),   # list of {text, start, duration}
         "timestamped": timestamped,
         "metadata": metadata
     }
+
+
+# ----------------------------------------------------------
+# SHARED ON-DISK CACHE WITH SINGLE-FLIGHT MISSES
+# ----------------------------------------------------------
+_inflight = {}  # cache file name -> [lock, waiters]
+_inflight_lock = threading.Lock()
+_cache_files = None  # files on disk, tracked after the first scan
+_cache_files_lock = threading.Lock()
+
+def _cache_path(video_id: str, languages) -> Path:
+    key = f"{video_id}|{','.join(languages)}"
+    return TRANSCRIPT_CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+def _remove_cache_file(path: Path):
+    global _cache_files
+    try:
+        path.unlink()
+    except OSError:
+        return
+    with _cache_files_lock:
+        if _cache_files is not None:
+            _cache_files -= 1
+
+def _read_cache(path: Path, ttl: int):
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry["fetched_at"] > ttl:
+        _remove_cache_file(path)
+        return None
+    try:
+        os.utime(path)  # mtime doubles as last use for eviction
+    except OSError:
+        pass
+    return entry["data"]
+
+def _write_cache(path: Path, data: Dict):
+    global _cache_files
+    existed = path.exists()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps({"fetched_at": time.time(), "data": data}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+    with _cache_files_lock:
+        # the directory is scanned once at first use and then only when it overflows
+        if _cache_files is None:
+            _cache_files = sum(1 for _ in path.parent.glob("*.json"))
+        elif not existed:
+            _cache_files += 1
+        if _cache_files > TRANSCRIPT_CACHE_MAX_FILES:
+            _evict_cache(path.parent)
+
+def _evict_cache(directory: Path):
+    # caller holds _cache_files_lock; trim to 90% so the next scan is max_files / 10 writes away
+    global _cache_files
+    files = list(directory.glob("*.json"))
+    target = int(TRANSCRIPT_CACHE_MAX_FILES * 0.9)
+    def mtime(p):
+        try:
+            return p.stat().st_mtime
+        except OSError:
+            return 0.0
+    removed = 0
+    for p in sorted(files, key=mtime)[:max(0, len(files) - target)]:
+        try:
+            p.unlink()
+            removed += 1
+        except OSError:
+            pass
+    _cache_files = len(files) - removed
+
+def download_transcript(video_id: str, languages=DEFAULT_LANGUAGES, ttl: int = TRANSCRIPT_CACHE_TTL) -> Dict:
+    """
+    Cached `fetch_transcript`. Entries are keyed by (video_id, languages) and
+    expire after `ttl` seconds; concurrent misses for the same key wait for
+    a single network fetch instead of each calling YouTube. Single-flight
+    holds within one process only: separate workers sharing the cache
+    directory may still fetch the same video once each.
+    """
+    languages = tuple(languages)
+    path = _cache_path(video_id, languages)
+    data = _read_cache(path, ttl)
+    if data is not None:
+        return data
+
+    with _inflight_lock:
+        entry = _inflight.setdefault(path.name, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            # another caller may have filled the cache while we waited
+            data = _read_cache(path, ttl)
+            if data is None:
+                data = fetch_transcript(video_id, languages)
+                try:
+                    _write_cache(path, data)
+                except OSError:
+                    pass
+    finally:
+        with _inflight_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _inflight.pop(path.name, None)
+    return data
+
+
+def download_transcripts(video_ids: List[str], max_workers: int = BULK_FETCH_WORKERS) -> List[Dict]:
+    """
+    Fetch many transcripts through `download_transcript` with a bounded pool.
+    Returns one {video_id, data | error} entry per id, in input order.
+    """
+    def fetch_one(vid):
+        try:
+            return {"video_id": vid, "data": download_transcript(vid)}
+        except Exception as e:
+            return {"video_id": vid, "error": str(e)}
+
+    if not video_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(video_ids)))) as executor:
+        return list(executor.map(fetch_one, video_ids))
+
+
+# ----------------------------------------------------------
+# ASYNC VARIANTS
+# ----------------------------------------------------------
+# youtube-transcript-api is synchronous, so these run it on worker threads
+# under the shared "youtube" limit instead of blocking the event loop.
+async def adownload_transcript(video_id: str, languages=DEFAULT_LANGUAGES, ttl: int = TRANSCRIPT_CACHE_TTL) -> Dict:
+    return await run_blocking("youtube", download_transcript, video_id, languages, ttl)
+
+async def adownload_transcripts(video_ids: List[str], on_result=None, max_workers: int = BULK_FETCH_WORKERS) -> List[Dict]:
+    # on_result(item) is called as each video finishes, in completion order;
+    # one request never holds more than max_workers of the shared "youtube" slots
+    pool = asyncio.Semaphore(max(1, max_workers))
+
+    async def fetch_one(vid):
+        try:
+            async with pool:
+                item = {"video_id": vid, "data": await adownload_transcript(vid)}
+        except Exception as e:
+            item = {"video_id": vid, "error": str(e)}
+        if on_result:
+            on_result(item)
+        return item
+    return list(await asyncio.gather(*(fetch_one(v) for v in video_ids)))
+
+async def aexpand_video_ids(urls: List[str]):
+    return await run_blocking("youtube", expand_video_ids, urls)
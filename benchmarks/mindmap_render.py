@@ -0,0 +1,61 @@
+"""
+Compare the Graphviz and native mindmap renderers on generated trees.
+
+    python -m benchmarks.mindmap_render --sizes 10 100 1000 --repeat 20
+"""
+import argparse
+import random
+import statistics
+import time
+
+from backend.generators.mindmap_generator import MINDMAP_RENDERERS
+
+
+def make_tree(n_nodes: int, max_children: int = 6, seed: int = 0) -> dict:
+    """A random mindmap with n_nodes subtopics, shaped like /extract output."""
+    rng = random.Random(seed)
+    root = {"central_topic": "Benchmark topic", "subtopics": []}
+    parents = [root["subtopics"]]
+    for i in range(n_nodes):
+        siblings = rng.choice(parents)
+        node = {"title": f"Topic {i}", "description": "a short description " * rng.randint(0, 3), "children": []}
+        siblings.append(node)
+        parents.append(node["children"])
+        if len(siblings) >= max_children:
+            parents = [p for p in parents if p is not siblings]
+    return root
+
+
+def bench(render, data, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        render(data)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--renderers", nargs="+", default=list(MINDMAP_RENDERERS), choices=list(MINDMAP_RENDERERS))
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} {'renderer':>10} {'median ms':>10} {'p95 ms':>10} {'svg KB':>8}")
+    for size in args.sizes:
+        data = make_tree(size)
+        for name in args.renderers:
+            render = MINDMAP_RENDERERS[name]
+            try:
+                svg = render(data)  # warm-up, and the output size
+            except Exception as e:
+                print(f"{size:>6} {name:>10} unavailable: {e}")
+                continue
+            times = sorted(bench(render, data, args.repeat))
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print(f"{size:>6} {name:>10} {statistics.median(times) * 1000:>10.2f} {p95 * 1000:>10.2f} {len(svg) / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Form, Response
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from backend.session_manager import create_session, get_session, delete_session, session_store
-from backend.utils.youtube_transcripts import extract_video_id, download_transcript
-from backend.utils.pdf_service import load_pdf_chunks
-from backend.utils.audio_service import transcribe
+from fastapi.concurrency import run_in_threadpool
+from backend.session_manager import create_session, get_session, delete_session, remove_source_segments, session_store
+from backend.job_manager import submit_job, get_job, set_stage, start_job_workers, stop_job_workers, JobQueueFull
+from backend.utils.youtube_transcripts import extract_video_id, adownload_transcript, aexpand_video_ids, adownload_transcripts
+from backend.utils.segment_transcript import build_transcript_windows, SEGMENT_MODES
+from backend.utils.pdf_service import load_pdf_chunks, get_pdf_pool, shutdown_pdf_pool
+from backend.utils.audio_service import atranscribe, aclose_client as aclose_transcription_client
 from backend.utils.text_service import chunk_plain_text
-from backend.utils.form_vector_index import build_collection_for_session
-from backend.utils.rag_agent import query_collection_and_answer
-from backend.generators.generate_notes import generate_notes_from_transcripts
-from backend.generators.generate_quiz import generate_quiz_from_transcripts
-from backend.generators.extractor_agent import MindmapExtractor, KeyPointExtractor, clean_json_field
-from backend.generators.mindmap_generator import generate_mindmap_svg_from_json
-from backend.generators.evaluation import AnswerEvaluator
-from pathlib import Path
+from backend.utils.upload_service import save_upload, UploadTooLargeError, UploadSizeLimitMiddleware, MAX_UPLOAD_BYTES
+from backend.utils.concurrency import run_blocking, install_blocking_executor
+from backend.utils.form_vector_index import build_collection_for_session, delete_source_from_collection, segment_id, ingest_id, index_fingerprint, EmbeddingError
+from backend.utils import gemini_client
+from backend.utils.answer_cache import answer_cache, ANSWER_CACHE_SEMANTIC
+from backend.utils.render_cache import mindmap_cache, render_key
+from backend.utils.embedding_providers import ProviderMismatchError
+from backend.utils.rag_agent import aquery_collection_and_answer, astream_query_collection_and_answer, aquery_collection_batch
+from backend.generators.generate_notes import (
+    agenerate_notes_from_transcripts, astream_notes_from_transcripts,
+    agenerate_notes_map_reduce, astream_notes_map_reduce, format_segments, use_map_reduce,
+)
+from backend.generators.generate_quiz import agenerate_quiz_from_transcripts, agenerate_quiz_per_topic, QUIZ_MODES
+from backend.generators.extractor_agent import (
+    MindmapExtractor, aextract_key_points_batch,
+    aextract_topics_windowed, parse_extraction, MINDMAP_WINDOW_CHARS,
+)
+from backend.generators.mindmap_generator import render_mindmap, MINDMAP_RENDERER, MINDMAP_RENDERERS
+from backend.generators.evaluation import agrade_answer, GRADING_MODES
+import asyncio
+import hashlib
 import shutil
 import tempfile
 import dspy
@@ -26,9 +42,20 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("uvicorn.error")
 
 api_key = os.getenv("GEMINI_API_KEY")
+QUIZ_GRADING_CONCURRENCY = int(os.getenv("QUIZ_GRADING_CONCURRENCY", "8"))
+YOUTUBE_SEGMENT_MODE = os.getenv("YOUTUBE_SEGMENT_MODE", "window")
+YOUTUBE_WINDOW_CHARS = int(os.getenv("YOUTUBE_WINDOW_CHARS", "1000"))
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart boundaries and the other form fields
 app = FastAPI(title="Lumos Backend")
 dspy.configure(lm=dspy.LM("gemini/gemini-2.0-flash", api_key=api_key))
 
+# reject oversized bodies before the multipart parser spools them to disk;
+# added first so CORS, the outer layer, still decorates its 413s
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=("/upload_pdf", "/upload_audio"),
+    max_body=MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # during hackathon: allow all
@@ -37,135 +64,494 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def drop_source(sess, source_id, source_type=None):
+    # removes a source from both the segment list and the index watermark/collection;
+    # callers hold sess["index_lock"] so a running build cannot write it back
+    removed = remove_source_segments(sess, source_id, source_type)
+    if sess.get("collection") is not None:
+        delete_source_from_collection(sess["collection"], source_id, source_type)
+    indexed = sess.setdefault("indexed", {})
+    for seg in removed:
+        indexed.pop(segment_id(seg), None)
+    uploads = sess["metadata"].get("uploads", {})
+    for h, prev in list(uploads.items()):
+        if prev["source_id"] == source_id and (source_type is None or prev["source_type"] == source_type):
+            del uploads[h]
+    if removed:
+        refresh_fingerprint(sess)
+    return len(removed)
+
+def refresh_fingerprint(sess):
+    # answers cached for the old contents are dropped unless another session still has them
+    old = sess.get("index_fingerprint")
+    sess["index_fingerprint"] = index_fingerprint(sess.get("indexed", {})) if sess.get("collection") is not None else None
+    if old and old != sess["index_fingerprint"]:
+        if not any(s.get("index_fingerprint") == old for s in session_store.values()):
+            answer_cache.invalidate(old)
+
+def find_duplicate_upload(sess, content_hash, replace=False):
+    # identical bytes already ingested in this session are not processed again
+    prev = sess["metadata"].get("uploads", {}).get(content_hash)
+    if prev and not replace:
+        return {"status": "duplicate", "added": 0, "content_hash": content_hash, **prev}
+    return None
+
+def add_segments(sess, segments, content_hash):
+    # ids carry the ingestion, so two sources sharing a name never overwrite each other in the index
+    iid = ingest_id(content_hash)
+    for seg in segments:
+        seg["ingest_id"] = iid
+    sess["segments"].extend(segments)
+
+def text_content_hash(texts):
+    return hashlib.sha256("\x00".join(texts).encode("utf-8")).hexdigest()
+
+def record_upload(sess, content_hash, source_id, source_type):
+    sess["metadata"].setdefault("uploads", {})[content_hash] = {"source_id": source_id, "source_type": source_type}
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match may list several tags, weak (W/) or "*"
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    # proxies must not buffer, or the first token waits for the whole body
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.on_event("startup")
+async def configure_blocking_pool():
+    install_blocking_executor(asyncio.get_running_loop())
+    start_job_workers()
+    get_pdf_pool()
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    await stop_job_workers()
+    await aclose_transcription_client()
+    shutdown_pdf_pool()
+
 @app.post("/create_session")
-def api_create_session():
+async def api_create_session():
     sid = create_session()
     return {"session_id": sid}
 
-@app.post("/add_youtube")
-def api_add_youtube(session_id: str = Form(...), youtube_url: str = Form(...)):
-    sess = get_session(session_id)
-    if not sess:
-        return JSONResponse({"error": "invalid session_id"}, status_code=400)
+# ----------------------------------------------------------
+# INGESTION: inline, or queued as a background job
+# ----------------------------------------------------------
+async def index_session(session_id, sess, job=None):
+    # only segments missing from the watermark are embedded and upserted
+    base = job["progress"] if job else 0
+    set_stage(job, "indexing", base)
+
+    def on_progress(done, total):
+        set_stage(job, "indexing", base + (99 - base) * done / total)
+
+    # the build mutates the watermark from a worker thread: no other build, delete or replace may overlap it
+    async with sess["index_lock"]:
+        client, collection, upserted = await run_blocking(
+            "indexing", build_collection_for_session,
+            session_id, list(sess["segments"]), indexed=sess.setdefault("indexed", {}), client=sess.get("client"),
+            on_progress=on_progress,
+        )
+        sess["client"] = client
+        sess["collection"] = collection
+        refresh_fingerprint(sess)
+    return {"segments": len(sess["segments"]), "upserted": upserted}
+
+async def run_ingestion(session_id, kind, work, background=False, auto_index=False, on_rejected=None):
+    """
+    Run `work(job)` and, with auto_index, index the session afterwards.
+    In background mode the job id is returned at once and /job_status
+    reports its stage and progress; otherwise the result is returned.
+    on_rejected() runs if the job never gets queued.
+    """
+    async def run(job=None):
+        result = await work(job)
+        if auto_index:
+            sess = get_session(session_id)
+            if not sess:
+                raise RuntimeError("session was reset before indexing")
+            result["index"] = await index_session(session_id, sess, job)
+        return result
+
+    if background:
+        try:
+            job_id = submit_job(session_id, kind, run)
+        except JobQueueFull as e:
+            if on_rejected:
+                on_rejected()
+            return JSONResponse({"error": str(e)}, status_code=503)
+        return JSONResponse({"status": "queued", "job_id": job_id}, status_code=202)
 
     try:
-        logger.debug(f"Received YouTube URL: {youtube_url}")
+        return await run()
+    except EmbeddingError as e:
+        # batches embedded before the failure stay in the embedding cache; a retry only pays for the rest
+        logger.exception(f"Error inside /{kind}")
+        return JSONResponse({"error": str(e)}, status_code=502)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception(f"Error inside /{kind}")   # <-- THIS IS IMPORTANT
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-        vid = extract_video_id(youtube_url)
-        logger.debug(f"Extracted video id: {vid}")
+def add_youtube_segments(sess, vid, fragments, segment_mode, window_chars, replace=False):
+    # merge tiny caption fragments into windows before they reach the index
+    windows = build_transcript_windows(fragments, mode=segment_mode, max_chars=window_chars)
+    logger.debug(f"Windows ({segment_mode}) for {vid}: {len(windows)}")
+
+    if replace:
+        drop_source(sess, vid, "youtube")
+
+    segments = [{
+        "source_type": "youtube",
+        "source_id": vid,
+        "start": win["start"],
+        "end": win["end"],
+        "chunk_index": i,
+        "text": win["text"]
+    } for i, win in enumerate(windows)]
+    add_segments(sess, segments, text_content_hash([w["text"] for w in windows]))
+    return len(windows)
+
+async def ingest_youtube(sess, youtube_url, replace, segment_mode, window_chars, job=None):
+    logger.debug(f"Received YouTube URL: {youtube_url}")
+
+    vid = extract_video_id(youtube_url)
+    logger.debug(f"Extracted video id: {vid}")
+
+    set_stage(job, "fetching_transcript", 10)
+    data = await adownload_transcript(vid)
+    logger.debug(f"Transcript data keys: {list(data.keys())}")
+
+    fragments = data["raw_fragments"]
+    logger.debug(f"Fragments length: {len(fragments)}")
+
+    set_stage(job, "segmenting", 60)
+    async with sess["index_lock"]:
+        added = add_youtube_segments(sess, vid, fragments, segment_mode, window_chars, replace)
+    set_stage(job, "segmenting", 70)
+    return {"status": "ok", "added": added, "fragments": len(fragments)}
+
+async def ingest_youtube_bulk(sess, urls, replace, segment_mode, window_chars, job=None):
+    set_stage(job, "expanding_urls", 2)
+    # a bad url or a private/deleted playlist is reported on its own; the rest still ingest
+    video_ids, failed_urls = await aexpand_video_ids(urls)
+    for f in failed_urls:
+        logger.warning(f"Could not expand {f['url']} in /add_youtube_bulk: {f['error']}")
+
+    fetched = [0]
+
+    def on_result(item):
+        fetched[0] += 1
+        set_stage(job, "fetching_transcripts", 5 + 60 * fetched[0] / len(video_ids))
+
+    set_stage(job, "fetching_transcripts", 5)
+    videos = []
+    total = 0
+    for item in await adownload_transcripts(video_ids, on_result=on_result):
+        vid = item["video_id"]
+        if "error" in item:
+            videos.append({"video_id": vid, "status": "error", "error": item["error"]})
+            continue
+        async with sess["index_lock"]:
+            added = add_youtube_segments(sess, vid, item["data"]["raw_fragments"], segment_mode, window_chars, replace)
+        total += added
+        videos.append({"video_id": vid, "status": "ok", "added": added})
+    set_stage(job, "segmenting", 70)
+
+    failed = sum(1 for v in videos if v["status"] == "error") + len(failed_urls)
+    if not failed:
+        status = "ok"
+    elif any(v["status"] == "ok" for v in videos):
+        status = "partial"
+    else:
+        status = "error"
+    return {"status": status, "added": total, "failed": failed, "videos": videos, "failed_urls": failed_urls}
+
+async def ingest_pdf(sess, tmpdir, tmp_path, content_hash, size, replace, job=None):
+    # owns the temp dir from here on, so a queued job can outlive the request
+    try:
+        set_stage(job, "extracting", 10)
+        # extraction fans out to a process pool; keep it off the event loop
+        chunks = await run_in_threadpool(load_pdf_chunks, tmp_path)
+        async with sess["index_lock"]:
+            if replace:
+                drop_source(sess, tmp_path.name, "pdf")
+            add_segments(sess, chunks, content_hash)
+            record_upload(sess, content_hash, tmp_path.name, "pdf")
+        set_stage(job, "extracting", 70)
+        return {"status": "ok", "added": len(chunks), "content_hash": content_hash, "bytes": size}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
-        data = download_transcript(vid)
-        logger.debug(f"Transcript data keys: {list(data.keys())}")
+async def ingest_audio(sess, tmpdir, tmp_path, content_hash, size, replace, job=None):
+    try:
+        set_stage(job, "transcribing", 10)
+        segments = await atranscribe(tmp_path, on_status=lambda status: set_stage(job, f"transcribing:{status}"))
+        async with sess["index_lock"]:
+            if replace:
+                drop_source(sess, tmp_path.name, "audio")
+            add_segments(sess, segments, content_hash)
+            record_upload(sess, content_hash, tmp_path.name, "audio")
+        set_stage(job, "transcribing", 70)
+        return {"status": "ok", "added": len(segments), "content_hash": content_hash, "bytes": size}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
-        fragments = data["raw_fragments"]
-        logger.debug(f"Fragments length: {len(fragments)}")
+async def receive_upload(sess, file, replace):
+    """
+    Stream the upload to a temp dir before any job is queued. Returns
+    (tmpdir, tmp_path, content_hash, size) or a response to send instead.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tmp_path, content_hash, size = await save_upload(file, tmpdir)
+    except UploadTooLargeError as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return JSONResponse({"error": str(e)}, status_code=500)
+    duplicate = find_duplicate_upload(sess, content_hash, replace)
+    if duplicate:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return duplicate
+    return tmpdir, tmp_path, content_hash, size
 
-        for i, frag in enumerate(fragments):
-            sess["segments"].append({
-                "source_type": "youtube",
-                "source_id": vid,
-                "start": frag.start,
-                "end": frag.start + frag.duration,
-                "chunk_index": i,
-                "text": frag.text
-            })
+@app.post("/add_youtube")
+async def api_add_youtube(session_id: str = Form(...), youtube_url: str = Form(...), replace: bool = Form(False),
+                          segment_mode: str = Form(YOUTUBE_SEGMENT_MODE), window_chars: int = Form(YOUTUBE_WINDOW_CHARS),
+                          background: bool = Form(False), auto_index: bool = Form(False)):
+    sess = get_session(session_id)
+    if not sess:
+        return JSONResponse({"error": "invalid session_id"}, status_code=400)
+    if segment_mode not in SEGMENT_MODES:
+        return JSONResponse({"error": f"segment_mode must be one of {list(SEGMENT_MODES)}"}, status_code=400)
 
-        return {"status": "ok", "added": len(fragments)}
+    return await run_ingestion(
+        session_id, "add_youtube",
+        lambda job: ingest_youtube(sess, youtube_url, replace, segment_mode, window_chars, job),
+        background, auto_index,
+    )
 
-    except Exception as e:
-        logger.exception("Error inside /add_youtube")   # <-- THIS IS IMPORTANT
-        return JSONResponse({"error": str(e)}, status_code=500)
-    
-@app.post("/upload_pdf")
-async def api_upload_pdf(session_id: str = Form(...), file: UploadFile = File(...)):
+@app.post("/add_youtube_bulk")
+async def api_add_youtube_bulk(session_id: str = Form(...), youtube_urls: str = Form(...), replace: bool = Form(False),
+                               segment_mode: str = Form(YOUTUBE_SEGMENT_MODE), window_chars: int = Form(YOUTUBE_WINDOW_CHARS),
+                               background: bool = Form(False), auto_index: bool = Form(False)):
+    # youtube_urls: playlist/channel urls and/or video urls, separated by newlines, commas or spaces
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error": "invalid session_id"}, status_code=400)
+    if segment_mode not in SEGMENT_MODES:
+        return JSONResponse({"error": f"segment_mode must be one of {list(SEGMENT_MODES)}"}, status_code=400)
+
+    urls = [u for u in re.split(r"[\s,]+", youtube_urls) if u]
+    return await run_ingestion(
+        session_id, "add_youtube_bulk",
+        lambda job: ingest_youtube_bulk(sess, urls, replace, segment_mode, window_chars, job),
+        background, auto_index,
+    )
 
-    # save temporarily
-    tmpdir = tempfile.mkdtemp()
-    tmp_path = Path(tmpdir) / file.filename
-    with open(tmp_path, "wb") as f:
-        f.write(await file.read())
+@app.post("/upload_pdf")
+async def api_upload_pdf(session_id: str = Form(...), file: UploadFile = File(...), replace: bool = Form(False),
+                         background: bool = Form(False), auto_index: bool = Form(False)):
+    sess = get_session(session_id)
+    if not sess:
+        return JSONResponse({"error": "invalid session_id"}, status_code=400)
 
-    try:
-        chunks = load_pdf_chunks(tmp_path)
-        sess["segments"].extend(chunks)
-        return {"status": "ok", "added": len(chunks)}
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+    # stream to a temp dir instead of reading the whole body into memory
+    received = await receive_upload(sess, file, replace)
+    if not isinstance(received, tuple):
+        return received
+    tmpdir, tmp_path, content_hash, size = received
+    return await run_ingestion(
+        session_id, "upload_pdf",
+        lambda job: ingest_pdf(sess, tmpdir, tmp_path, content_hash, size, replace, job),
+        background, auto_index, on_rejected=lambda: shutil.rmtree(tmpdir, ignore_errors=True),
+    )
 
 @app.post("/upload_audio")
-async def api_upload_audio(session_id: str = Form(...), file: UploadFile = File(...)):
+async def api_upload_audio(session_id: str = Form(...), file: UploadFile = File(...), replace: bool = Form(False),
+                           background: bool = Form(False), auto_index: bool = Form(False)):
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error": "invalid session_id"}, status_code=400)
-    tmpdir = tempfile.mkdtemp()
-    tmp_path = Path(tmpdir) / file.filename
-    with open(tmp_path, "wb") as f:
-        f.write(await file.read())
 
-    try:
-        segments = transcribe(tmp_path)
-        sess["segments"].extend(segments)
-        return {"status": "ok", "added": len(segments)}
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+    received = await receive_upload(sess, file, replace)
+    if not isinstance(received, tuple):
+        return received
+    tmpdir, tmp_path, content_hash, size = received
+    return await run_ingestion(
+        session_id, "upload_audio",
+        lambda job: ingest_audio(sess, tmpdir, tmp_path, content_hash, size, replace, job),
+        background, auto_index, on_rejected=lambda: shutil.rmtree(tmpdir, ignore_errors=True),
+    )
 
 @app.post("/add_text")
-def api_add_text(session_id: str = Form(...), source_name: str = Form("inline"), text: str = Form(...)):
+async def api_add_text(session_id: str = Form(...), source_name: str = Form("inline"), text: str = Form(...), replace: bool = Form(False),
+                       auto_index: bool = Form(False)):
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error": "invalid session_id"}, status_code=400)
-    chunks = chunk_plain_text(text, source_id=source_name)
-    sess["segments"].extend(chunks)
-    return {"status": "ok", "added": len(chunks)}
+
+    async def ingest_text(job=None):
+        chunks = chunk_plain_text(text, source_id=source_name)
+        async with sess["index_lock"]:
+            if replace:
+                drop_source(sess, source_name, "text")
+            add_segments(sess, chunks, text_content_hash([text]))
+        return {"status": "ok", "added": len(chunks)}
+
+    return await run_ingestion(session_id, "add_text", ingest_text, auto_index=auto_index)
 
 @app.post("/build_index")
-def api_build_index(session_id: str = Form(...)):
+async def api_build_index(session_id: str = Form(...), background: bool = Form(False)):
+    sess = get_session(session_id)
+    if not sess:
+        return JSONResponse({"error": "invalid session_id"}, status_code=400)
+
+    async def build(job=None):
+        return {"status": "ok", **await index_session(session_id, sess, job)}
+
+    return await run_ingestion(session_id, "build_index", build, background)
+
+@app.post("/job_status")
+async def api_job_status(job_id: str = Form(...)):
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse({"error": "unknown job_id"}, status_code=404)
+    return job
+
+@app.post("/delete_source")
+async def api_delete_source(session_id: str = Form(...), source_id: str = Form(...), source_type: str = Form(None)):
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error": "invalid session_id"}, status_code=400)
-    # if collection already exists, rebuild from scratch (fresh start for new upload)
-    client, collection = build_collection_for_session(session_id, sess["segments"])
-    sess["client"] = client
-    sess["collection"] = collection
-    return {"status": "ok", "segments": len(sess["segments"])}
+    async with sess["index_lock"]:
+        removed = drop_source(sess, source_id, source_type)
+    if not removed:
+        return JSONResponse({"error": "unknown source_id"}, status_code=404)
+    return {"status": "ok", "removed": removed, "segments": len(sess["segments"])}
 
 @app.post("/ask")
-def api_ask(session_id: str = Form(...), question: str = Form(...)):
+async def api_ask(session_id: str = Form(...), question: str = Form(...), semantic_cache: bool = Form(ANSWER_CACHE_SEMANTIC)):
     sess = get_session(session_id)
     if not sess or not sess.get("collection"):
         return JSONResponse({"error": "invalid session_id or index not built"}, status_code=400)
-    out = query_collection_and_answer(sess["collection"], question, n_results=5)
+    try:
+        out = await aquery_collection_and_answer(
+            sess["collection"], question, n_results=5, fingerprint=sess.get("index_fingerprint"), semantic=semantic_cache
+        )
+    except ProviderMismatchError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
     return out
 
+@app.post("/ask_batch")
+async def api_ask_batch(session_id: str = Form(...), questions: str = Form(...), semantic_cache: bool = Form(ANSWER_CACHE_SEMANTIC)):
+    # questions: JSON list of strings
+    sess = get_session(session_id)
+    if not sess or not sess.get("collection"):
+        return JSONResponse({"error": "invalid session_id or index not built"}, status_code=400)
+    try:
+        items = json.loads(questions)
+        if not isinstance(items, list) or not all(isinstance(q, str) for q in items):
+            raise ValueError("expected a list of strings")
+    except ValueError as e:
+        return JSONResponse({"error": f"questions must be a JSON list of strings: {e}"}, status_code=400)
+
+    try:
+        results = await aquery_collection_batch(
+            sess["collection"], items, n_results=5, fingerprint=sess.get("index_fingerprint"), semantic=semantic_cache
+        )
+    except ProviderMismatchError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    failed = [i for i, r in enumerate(results) if "error" in r]
+    return {"results": results, "answered": len(results) - len(failed), "failed": failed}
+
+@app.post("/ask_stream")
+async def api_ask_stream(session_id: str = Form(...), question: str = Form(...), semantic_cache: bool = Form(ANSWER_CACHE_SEMANTIC)):
+    sess = get_session(session_id)
+    if not sess or not sess.get("collection"):
+        return JSONResponse({"error": "invalid session_id or index not built"}, status_code=400)
+
+    async def events():
+        try:
+            async for kind, payload in astream_query_collection_and_answer(
+                sess["collection"], question, n_results=5, fingerprint=sess.get("index_fingerprint"), semantic=semantic_cache
+            ):
+                yield sse_event(kind, payload)
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.exception("Error inside /ask_stream")
+            yield sse_event("error", {"error": str(e)})
+
+    return sse_response(events())
+
+@app.get("/cache_stats")
+async def api_cache_stats():
+    return {"answers": answer_cache.stats(), "gemini": gemini_client.stats(), "mindmaps": mindmap_cache.stats()}
+
 @app.post("/reset")
-def api_reset(session_id: str = Form(...)):
+async def api_reset(session_id: str = Form(...)):
     ok = delete_session(session_id)
     return {"deleted": ok}
 
 @app.post("/get_notes")
-def api_get_notes(session_id: str = Form(...)):
+async def api_get_notes(session_id: str = Form(...), mode: str = Form("auto")):
+    # mode: "single" prompt, "map_reduce" over token-budgeted chunks, or "auto" by session size
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error":"invalid session_id"}, status_code=400)
     
     if "segments" not in sess or len(sess["segments"])==0:
         return JSONResponse({"error":"No content added"}, status_code=400)
-    
-    docs = [s["text"] for s in sess["segments"] if s.get("text")]
 
-    notes = generate_notes_from_transcripts(docs)
+    segments = list(sess["segments"])
+    if use_map_reduce(segments, mode):
+        notes = await agenerate_notes_map_reduce(segments)
+    else:
+        notes = await agenerate_notes_from_transcripts(format_segments(segments))
     return {"notes":notes}
 
+@app.post("/get_notes_stream")
+async def api_get_notes_stream(session_id: str = Form(...), mode: str = Form("auto")):
+    sess = get_session(session_id)
+    if not sess:
+        return JSONResponse({"error":"invalid session_id"}, status_code=400)
+
+    if "segments" not in sess or len(sess["segments"])==0:
+        return JSONResponse({"error":"No content added"}, status_code=400)
+
+    segments = list(sess["segments"])
+    if use_map_reduce(segments, mode):
+        stream = astream_notes_map_reduce(segments)
+    else:
+        stream = astream_notes_from_transcripts(format_segments(segments))
+
+    async def events():
+        try:
+            async for text in stream:
+                yield sse_event("token", text)
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.exception("Error inside /get_notes_stream")
+            yield sse_event("error", {"error": str(e)})
+
+    return sse_response(events())
+
 @app.post("/extract")
-def api_extract_topics_json(session_id: str = Form(...)):
-    extractor = MindmapExtractor()
+async def api_extract_topics_json(session_id: str = Form(...), mode: str = Form("auto")):
+    # mode: "single" call over the whole transcript, "windowed" parallel extraction, or "auto" by length
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error":"invalid session_id"}, status_code=400)
@@ -173,84 +559,123 @@ def api_extract_topics_json(session_id: str = Form(...)):
     if "segments" not in sess or len(sess["segments"])==0:
         return JSONResponse({"error":"No content added"}, status_code=400)
 
-    transcript = [s["text"] for s in sess["segments"] if s.get("text")]
-    transcript = ' '.join(transcript)
+    texts = [s["text"] for s in sess["segments"] if s.get("text")]
+    windowed = mode == "windowed" or (mode == "auto" and sum(len(t) + 1 for t in texts) > MINDMAP_WINDOW_CHARS)
     try:
-        result = extractor.forward(transcript=transcript)
-        def clean_json_field(field:str):
-            field = re.sub(r"^```(?:json)?\n?", "", field.strip())
-            field = re.sub(r"\n?```$", "", field)
-            return json.loads(field)
-        subtopics = clean_json_field(result.subtopics)
-        data = {"central_topic":result.central_topic, "subtopics":subtopics}
+        if windowed:
+            data = await aextract_topics_windowed(texts)
+        else:
+            extractor = MindmapExtractor()
+            result = await extractor.acall(transcript=' '.join(texts))
+            data = parse_extraction(result)
         sess["extracted_topics"] = data
         return data
     except Exception as e:
-        return JSONResponse({"error":"Error while extracting topics:{e}"}, status_code=500)
+        return JSONResponse({"error":f"Error while extracting topics:{e}"}, status_code=500)
 
-@app.post("/generate_mindmap")
-def api_generate_mindmap(session_id: str = Form(...)):
+async def mindmap_response(session_id, renderer, if_none_match=None):
+    # the content key doubles as the ETag, so revalidation never renders
     sess = get_session(session_id)
 
     if not sess or "extracted_topics" not in sess:
         return JSONResponse({"error": "Run /extract first"}, status_code=400)
+    if renderer not in MINDMAP_RENDERERS:
+        return JSONResponse({"error": f"renderer must be one of {list(MINDMAP_RENDERERS)}"}, status_code=400)
 
     data = sess["extracted_topics"]
+    key = render_key(data, renderer=renderer)
+    headers = {"ETag": f'"{key}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, f'"{key}"'):
+        return Response(status_code=304, headers=headers)
 
-    
-    svg_clean = generate_mindmap_svg_from_json(data)
-    return Response(content=svg_clean, media_type="image/svg+xml")
+    svg_clean = mindmap_cache.lookup(key)
+    if svg_clean is None:
+        # disk reads and both renderers block (graphviz also forks a process); run them off the event loop
+        svg_clean = await run_blocking("render", mindmap_cache.load_or_render, key, render_mindmap, data, renderer)
+    return Response(content=svg_clean, media_type="image/svg+xml", headers=headers)
+
+@app.post("/generate_mindmap")
+async def api_generate_mindmap(session_id: str = Form(...), renderer: str = Form(MINDMAP_RENDERER)):
+    # renderer: "graphviz" (forks `dot`) or "native" in-process layout
+    return await mindmap_response(session_id, renderer)
+
+@app.get("/mindmap")
+async def api_get_mindmap(request: Request, session_id: str, renderer: str = MINDMAP_RENDERER):
+    # cacheable twin of /generate_mindmap: browsers revalidate it with If-None-Match and get 304
+    return await mindmap_response(session_id, renderer, request.headers.get("if-none-match"))
 
 @app.post("/get_quiz_questions")
-def api_generate_quiz(session_id: str = Form(...), num_questions: int = Form(5), difficulty: str = Form("medium"), type:str = Form("Short")):
+async def api_generate_quiz(session_id: str = Form(...), num_questions: int = Form(5), difficulty: str = Form("medium"), type:str = Form("Short"),
+                            mode: str = Form("auto")):
+    # mode: "full" session text in one prompt, "per_topic" retrieval-scoped prompts, or "auto"
     sess = get_session(session_id)
     if not sess:
         return JSONResponse({"error": "invalid session_id"}, status_code=400)
 
+    if mode not in QUIZ_MODES:
+        return JSONResponse({"error": f"mode must be one of {list(QUIZ_MODES)}"}, status_code=400)
+
     if "segments" not in sess or not sess["segments"]:
         return JSONResponse({"error": "No content added"}, status_code=400)
     
     if "extracted_topics" not in sess:
         return JSONResponse({"error": "Please call /extract first."}, status_code=400)
 
-    # raw text
-    docs = [s["text"] for s in sess["segments"] if s.get("text")]
-    full_context = "\n".join(docs)
-
     # structured context
     extracted = sess["extracted_topics"]
 
-    quiz = generate_quiz_from_transcripts(
-        topics_json=extracted,
-        transcript=full_context,
-        num_questions=num_questions,
-        difficulty=difficulty,
-        type=type
-    )
+    # auto only retrieves from an index that covers every segment, else questions would skip new material
+    indexed = sess.get("indexed") or {}
+    index_current = sess.get("collection") is not None and all(segment_id(s) in indexed for s in sess["segments"])
+    per_topic = mode == "per_topic" or (mode == "auto" and index_current and extracted.get("subtopics"))
+    if per_topic and sess.get("collection") is None:
+        return JSONResponse({"error": "Please call /build_index first."}, status_code=400)
+
+    failed_topics = []
+    if per_topic:
+        quiz, failed_topics = await agenerate_quiz_per_topic(
+            sess["collection"],
+            topics_json=extracted,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            type=type
+        )
+    else:
+        # raw text
+        docs = [s["text"] for s in sess["segments"] if s.get("text")]
+        full_context = "\n".join(docs)
+
+        quiz = await agenerate_quiz_from_transcripts(
+            topics_json=extracted,
+            transcript=full_context,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            type=type
+        )
+
+    # reference answers never change, so their key points are extracted once here
+    for q, key_points in zip(quiz, await aextract_key_points_batch([q["answer"] for q in quiz])):
+        if key_points is not None:
+            q["key_points"] = key_points
 
     sess["quiz"] = quiz
     sess["quiz_answers"] = {}
-    return {"quiz_questions": quiz}
+    return {"quiz_questions": quiz, "failed_topics": failed_topics}
 
 @app.post("/submit_answer")
-def submit_answer(session_id: str = Form(...), question_num:int = Form(...), user_answer:str = Form(...)):
-
+async def submit_answer(session_id: str = Form(...), question_num:int = Form(...), user_answer:str = Form(...), grading: str = Form("llm")):
+    # grading: "llm" always asks the evaluator, "local" scores clear cases from key points first
     sess = get_session(session_id)
-    if "quiz" not in sess:
+    if not sess or "quiz" not in sess:
         return JSONResponse({"error":"No quiz started"}, status_code=400)
+    if grading not in GRADING_MODES:
+        return JSONResponse({"error": f"grading must be one of {list(GRADING_MODES)}"}, status_code=400)
     
     q = next((q for q in sess["quiz"] if q["question_num"]==question_num), None)
     if not q:
         return JSONResponse({"error":"invalid question_num"}, status_code=400)
-    
-    correct_answer = q["answer"]
-    keypoints_extractor = KeyPointExtractor()
-    result_raw = keypoints_extractor(answer=correct_answer)
-    result = clean_json_field(result_raw.key_points)
 
-    evaluator = AnswerEvaluator()
-    evaluation_json_raw = evaluator(user_answer=user_answer, keypoints=result,  correct_answer=correct_answer)
-    evaluations_json = clean_json_field(evaluation_json_raw.evaluation_json)
+    evaluations_json = await agrade_answer(q, user_answer, mode=grading)
 
     sess["quiz_answers"][question_num] = {
         "user_answer":user_answer, 
@@ -259,8 +684,41 @@ def submit_answer(session_id: str = Form(...), question_num:int = Form(...), use
 
     return evaluations_json
 
+@app.post("/submit_quiz")
+async def submit_quiz(session_id: str = Form(...), answers: str = Form(...), grading: str = Form("llm")):
+    # answers: JSON list of {"question_num": int, "user_answer": str}
+    sess = get_session(session_id)
+    if not sess or "quiz" not in sess:
+        return JSONResponse({"error":"No quiz started"}, status_code=400)
+    if grading not in GRADING_MODES:
+        return JSONResponse({"error": f"grading must be one of {list(GRADING_MODES)}"}, status_code=400)
+    try:
+        items = [(int(a["question_num"]), str(a["user_answer"])) for a in json.loads(answers)]
+    except (ValueError, TypeError, KeyError) as e:
+        return JSONResponse({"error": f"answers must be a JSON list of question_num/user_answer objects: {e}"}, status_code=400)
+
+    questions = {q["question_num"]: q for q in sess["quiz"]}
+    pool = asyncio.Semaphore(QUIZ_GRADING_CONCURRENCY)
+
+    async def grade(question_num, user_answer):
+        q = questions.get(question_num)
+        if q is None:
+            return {"question_num": question_num, "error": "invalid question_num"}
+        try:
+            async with pool:
+                evaluation = await agrade_answer(q, user_answer, mode=grading)
+        except Exception as e:
+            logger.exception("Error grading question %s", question_num)
+            return {"question_num": question_num, "error": str(e)}
+        sess["quiz_answers"][question_num] = {"user_answer": user_answer, **evaluation}
+        return {"question_num": question_num, **evaluation}
+
+    results = await asyncio.gather(*(grade(n, a) for n, a in items))
+    failed = [r["question_num"] for r in results if "error" in r]
+    return {"results": results, "graded": len(results) - len(failed), "failed": failed}
+
 @app.post("/finish_quiz")
-def finish_quiz(session_id:str = Form(...)):
+async def finish_quiz(session_id:str = Form(...)):
     sess = get_session(session_id)
 
     quiz = sess.get("quiz", [])
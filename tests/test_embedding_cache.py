@@ -0,0 +1,28 @@
+from backend.utils import form_vector_index
+from backend.utils.embedding_cache import EmbeddingCache
+from backend.utils.embedding_providers import HashingEmbeddingProvider
+
+
+class CountingProvider(HashingEmbeddingProvider):
+    def __init__(self):
+        super().__init__(dimension=16)
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def test_second_call_is_served_from_cache(tmp_path, monkeypatch):
+    provider = CountingProvider()
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3")
+    monkeypatch.setattr(form_vector_index, "get_embedding_provider", lambda: provider)
+    monkeypatch.setattr(form_vector_index, "get_embedding_cache", lambda: cache)
+
+    first = form_vector_index.embed_texts(["a", "b", "c"])
+    assert provider.embedded == 3
+    assert len(cache) == 3
+
+    second = form_vector_index.embed_texts(["a", "b", "c"])
+    assert provider.embedded == 3
+    assert [[round(x, 5) for x in v] for v in second] == [[round(x, 5) for x in v] for v in first]